@@ -0,0 +1,51 @@
+"""
+Size and speed of the preset formats over a synthetic library: the old pretty printed json files,
+minified json, and presetCodec with each compression.
+
+    python benchmarks/bench_codec.py [--presets 3000] [--params 400]
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from FitCheck import presetCodec
+from FitCheck.avatarPreset import AvatarPreset
+from bench_memory import synthetic_preset_dict
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--presets", type=int, default=3000)
+    parser.add_argument("--params", type=int, default=400)
+    args = parser.parse_args()
+
+    presets = [
+        AvatarPreset.from_dict(synthetic_preset_dict(f"avtr_{n % 20:08d}", f"Preset {n}", args.params, n))
+        for n in range(args.presets)
+    ]
+    formats = {
+        "json indent=2 (legacy)": (lambda p: json.dumps(p.to_dict(), indent=2).encode(), presetCodec.decode),
+        "json minified": (presetCodec.encode_json, presetCodec.decode),
+        "codec": (lambda p: presetCodec.encode(p, presetCodec.COMPRESSION_NONE), presetCodec.decode),
+        "codec + zlib": (lambda p: presetCodec.encode(p, presetCodec.COMPRESSION_ZLIB), presetCodec.decode),
+        "codec + lzma": (lambda p: presetCodec.encode(p, presetCodec.COMPRESSION_LZMA), presetCodec.decode),
+    }
+    print(f"{args.presets} presets x {args.params} parameters")
+    print(f"  {'format':<24} {'size':>10} {'encode':>10} {'load':>10}")
+    for label, (enc, dec) in formats.items():
+        start = time.perf_counter()
+        blobs = [enc(p) for p in presets]
+        encodeTime = time.perf_counter() - start
+        start = time.perf_counter()
+        for blob in blobs:
+            dec(blob)
+        loadTime = time.perf_counter() - start
+        size = sum(len(b) for b in blobs)
+        print(f"  {label:<24} {size / 2**20:8.1f}MB {encodeTime:9.2f}s {loadTime:9.2f}s")
+
+if __name__ == "__main__":
+    main()
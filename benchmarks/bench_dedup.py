@@ -0,0 +1,80 @@
+"""
+PresetStore with and without dedup over a library where presets of one avatar share most values,
+like outfits saved from the same avatar: database size, load time, and the heap held by every preset loaded.
+
+    python benchmarks/bench_dedup.py [--presets 2000] [--params 400] [--avatars 20] [--changed 0.05]
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from FitCheck.avatarPreset import AvatarPreset
+from FitCheck.presetStore import PresetStore
+from bench_memory import synthetic_preset_dict
+
+def similar_library(presets: int, params: int, avatars: int, changed: float) -> list[AvatarPreset]:
+    rng = random.Random(0)
+    library = []
+    for n in range(presets):
+        data = synthetic_preset_dict(f"avtr_{n % avatars:08d}", f"Preset {n}", params, n % avatars)
+        for p in data["parameters"]:
+            if rng.random() < changed:
+                p["value"] = rng.random()
+        library.append(AvatarPreset.from_dict(data))
+    return library
+
+def measure(label: str, library: list[AvatarPreset], dedup: bool):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "presets.db"
+        store = PresetStore(path, dedup=dedup)
+        start = time.perf_counter()
+        for preset in library:
+            store.put(preset)
+        writeTime = time.perf_counter() - start
+        store._conn.execute("VACUUM")
+        size = os.path.getsize(path)
+        store.close()
+
+        store = PresetStore(path, dedup=dedup)
+        start = time.perf_counter()
+        for p in library:
+            store.get(p.avatarId, p.name)
+        loadTime = time.perf_counter() - start
+        store.close()
+
+        store = PresetStore(path, dedup=dedup)
+        gc.collect()
+        tracemalloc.start()
+        loaded = [store.get(p.avatarId, p.name) for p in library]
+        gc.collect()
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        store.close()
+        del loaded
+    print(f"  {label:<10} {size / 2**20:8.1f}MB {writeTime:9.2f}s {loadTime:9.2f}s {current / 2**20:9.1f}MiB")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--presets", type=int, default=2000)
+    parser.add_argument("--params", type=int, default=400)
+    parser.add_argument("--avatars", type=int, default=20)
+    parser.add_argument("--changed", type=float, default=0.05, help="share of values a preset changes from its avatar's usual ones")
+    args = parser.parse_args()
+
+    library = similar_library(args.presets, args.params, args.avatars, args.changed)
+    print(f"{args.presets} presets x {args.params} parameters, {args.changed:.0%} changed per preset")
+    print(f"  {'store':<10} {'size':>10} {'write':>10} {'load':>10} {'loaded':>12}")
+    measure("full", library, False)
+    measure("dedup", library, True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Measures the heap held by a loaded preset library, the way parse_existing_presets builds it (json -> AvatarPreset.from_dict).
+
+    python benchmarks/bench_memory.py [--presets 2000] [--params 400] [--avatars 20]
+"""
+import argparse
+import gc
+import json
+import sys
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from FitCheck.avatarPreset import AvatarPreset
+
+def synthetic_preset_dict(avatarId: str, name: str, params: int, seed: int) -> dict:
+    parameters = []
+    for i in range(params):
+        rawName = f"FT/v2/Face_{i:04d}" if i % 10 == 0 else f"Toggle_{i:04d}"
+        kind = i % 3
+        value = bool((i + seed) % 2) if kind == 0 else ((i + seed) % 8 if kind == 1 else ((i * seed) % 100) / 100)
+        parameters.append({"name": rawName.rsplit("/", 1)[-1], "path": f"/avatar/parameters/{rawName}", "value": value})
+    return {"name": name, "avatarId": avatarId, "uniqueKey": "", "parameters": parameters}
+
+def synthetic_library(presets: int, params: int, avatars: int) -> list[str]:
+    """Serialized presets, parsed back one by one like files read from disk so no string is shared by accident."""
+    return [
+        json.dumps(synthetic_preset_dict(f"avtr_{n % avatars:08d}-0000-0000-0000-000000000000", f"Preset {n}", params, n))
+        for n in range(presets)
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--presets", type=int, default=2000)
+    parser.add_argument("--params", type=int, default=400)
+    parser.add_argument("--avatars", type=int, default=20)
+    args = parser.parse_args()
+
+    blobs = synthetic_library(args.presets, args.params, args.avatars)
+    gc.collect()
+    tracemalloc.start()
+    library: dict[str, dict[str, AvatarPreset]] = {}
+    for blob in blobs:
+        preset = AvatarPreset.from_dict(json.loads(blob))
+        library.setdefault(preset.avatarId, {})[preset.name] = preset
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    total = args.presets * args.params
+    print(f"{args.presets} presets x {args.params} parameters ({total} parameters)")
+    print(f"  resident {current / 2**20:8.1f} MiB  ({current / total:6.1f} B/parameter)")
+    print(f"  peak     {peak / 2**20:8.1f} MiB")
+
+if __name__ == "__main__":
+    main()
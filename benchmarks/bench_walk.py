@@ -0,0 +1,98 @@
+"""
+Compares the OSCQuery tree walk used to build avatar parameters before and after the iterative walker.
+
+    python benchmarks/bench_walk.py [--params 5000] [--tree recorded.json] [--repeat 20]
+
+--tree takes a recorded OSCQuery answer, either the root node or the /avatar/parameters node.
+"""
+import argparse
+import json
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from FitCheck.avatarParameter import AvatarParameter
+from FitCheck.vrcClient import walk_parameters, read_live_values
+
+def legacy_walk_node(node, prefix=""):
+    # the recursive walker as it was before walk_parameters
+    if "CONTENTS" in node:
+        for name, sub in node["CONTENTS"].items():
+            new_prefix = f"{prefix}/{name}" if prefix else name
+            yield from legacy_walk_node(sub, new_prefix)
+    else:
+        yield {
+            "path": prefix,
+            "type": node.get("TYPE"),
+            "default": node.get("DEFAULT"),
+            "range": node.get("RANGE"),
+            "tags": node.get("TAGS"),
+            "value": node.get("VALUE"),
+        }
+
+def legacy_get_avatar_params(node):
+    paramList = []
+    for p in list(legacy_walk_node(node, "/avatar/parameters")):
+        paramName = str(p['path']).split("/")[-1]
+        paramList.append(AvatarParameter(paramName, p['path'], p['value']))
+    return paramList
+
+def synthetic_parameters_node(count: int, nested_every: int = 10):
+    """A /avatar/parameters node with count leaves, every nested_every-th one grouped under FT/v2 like face tracking."""
+    contents = {}
+    nested = {}
+    for i in range(count):
+        kind = i % 3
+        leaf = {
+            "ACCESS": 3,
+            "TYPE": "T" if kind == 0 else ("i" if kind == 1 else "f"),
+            "VALUE": [bool(i % 2)] if kind == 0 else ([i % 255] if kind == 1 else [i / count]),
+            "DESCRIPTION": "",
+        }
+        if kind == 2:
+            leaf["RANGE"] = [{"MIN": -1.0, "MAX": 1.0}]
+        name = f"Param_{i:05d}"
+        if nested_every and i % nested_every == 0:
+            leaf["FULL_PATH"] = f"/avatar/parameters/FT/v2/{name}"
+            nested[name] = leaf
+        else:
+            leaf["FULL_PATH"] = f"/avatar/parameters/{name}"
+            contents[name] = leaf
+    if nested:
+        contents["FT"] = {"FULL_PATH": "/avatar/parameters/FT", "CONTENTS": {"v2": {"FULL_PATH": "/avatar/parameters/FT/v2", "CONTENTS": nested}}}
+    return {"FULL_PATH": "/avatar/parameters", "ACCESS": 0, "CONTENTS": contents}
+
+def load_parameters_node(path: str):
+    node = json.loads(Path(path).read_text())
+    try:
+        return node["CONTENTS"]["avatar"]["CONTENTS"]["parameters"]
+    except KeyError:
+        return node
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--params", type=int, default=5000)
+    parser.add_argument("--tree", help="recorded OSCQuery json")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    node = load_parameters_node(args.tree) if args.tree else synthetic_parameters_node(args.params)
+    legacy = legacy_get_avatar_params(node)
+    current = walk_parameters(node)
+    assert [(p.name, p.path, p.rawName, p.value) for p in legacy] == [(p.name, p.path, p.rawName, p.value) for p in current]
+
+    cases = {
+        "legacy walk_node + split": lambda: legacy_get_avatar_params(node),
+        "walk_parameters": lambda: walk_parameters(node),
+        "walk_parameters with_meta": lambda: walk_parameters(node, with_meta=True),
+        "read_live_values": lambda: read_live_values(node),
+    }
+    print(f"{len(current)} parameters, best of {args.repeat}")
+    for label, fn in cases.items():
+        best = min(timeit.repeat(fn, number=1, repeat=args.repeat))
+        print(f"  {label:<28} {best * 1000:8.2f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+End to end check of the save and apply paths against the simulator, pass or fail. Exits 1 when the game state
+or the saved presets are not what they should be, so it can run before a release or in CI.
+
+    python benchmarks/check_simulator.py [--params 200] [--switch-delay 0.5] [--osc-port 9000] [--reply-port 9001]
+
+Steps:
+    save        the saved preset holds every non blacklisted parameter of the avatar, as stored on disk
+    apply       a preset differing by a few values sends those values only, the game ends up with the preset
+    switch      a preset of another avatar switches avatar, then applies
+    supersede   applies clicked faster than the game switches: the last one wins, back to the worn avatar included
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from FitCheck.avatarParameter import AvatarParameter
+from FitCheck.avatarPreset import AvatarPreset
+from vrc_simulator import VRChatSimulator, synthetic_avatar, PARAMETERS_PREFIX
+
+class Checker():
+    def __init__(self):
+        """
+        Records the outcome of every check, failures are printed as they happen.
+        """
+        self.passed = 0
+        self.failures: list[str] = []
+        pass
+    def check(self, step: str, ok: bool, detail: str = ""):
+        if ok:
+            self.passed += 1
+            print(f"  ok    {step}")
+        else:
+            self.failures.append(step)
+            print(f"  FAIL  {step}{': ' + detail if detail else ''}")
+
+def same_value(a, b) -> bool:
+    # floats go through OSC as float32
+    if isinstance(a, float) or isinstance(b, float):
+        return not isinstance(a, bool) and not isinstance(b, bool) and abs(a - b) < 1e-6
+    return type(a) is type(b) and a == b
+
+def mismatches(preset: AvatarPreset, values: dict) -> list[str]:
+    """
+    Names of the preset parameters whose value differs from values ({rawName: value}).
+    """
+    return [p.rawName for p in preset.parameters if p.rawName not in values or not same_value(p.value, values[p.rawName])]
+
+def changed_preset(preset: AvatarPreset, name: str, count: int) -> AvatarPreset:
+    """
+    Copy of preset with the first count values changed.
+    """
+    params = []
+    for i, p in enumerate(preset.parameters):
+        value = p.value
+        if i < count:
+            value = (not value) if isinstance(value, bool) else (round((value + 0.5) % 1, 3) if isinstance(value, float) else (value + 1) % 8)
+        params.append(AvatarParameter(p.name, p.path, value, p.rawName))
+    return AvatarPreset(name, preset.avatarId, params, preset.filterKey)
+
+def avatar_preset(manager, sim: VRChatSimulator, avatarId: str, name: str) -> AvatarPreset:
+    """
+    What a save on avatarId should give, built from the simulator state.
+    """
+    params = [AvatarParameter(raw[raw.rfind("/") + 1:], PARAMETERS_PREFIX + raw, value, raw) for raw, value in sim.avatars[avatarId].items()]
+    return AvatarPreset(name, avatarId, manager.blacklist.filter(params), manager.blacklist.key)
+
+async def run_checks(checker: Checker, sim: VRChatSimulator, args):
+    from FitCheck.asyncVrcClient import AsyncVRCClient
+    from FitCheck.asyncAvatarManager import AsyncAvatarManager
+    client = AsyncVRCClient(sim.oscqPort)
+    client.listenPort = args.reply_port
+    await client.start_async()
+    manager = AsyncAvatarManager(client)
+    try:
+        print("save:")
+        saved = await manager.save_avatar_state_async("check_a")
+        expected = avatar_preset(manager, sim, "avtr_check_a", "check_a")
+        wrong = mismatches(expected, {p.rawName: p.value for p in saved.parameters})
+        checker.check("save reads every parameter", saved.avatarId == "avtr_check_a" and not wrong and len(saved.parameters) == len(expected.parameters),
+                      f"{saved.avatarId}, {len(saved.parameters)}/{len(expected.parameters)} parameters, wrong: {wrong[:5]}")
+        checker.check("save is written to the store", manager.flush(10) and manager.store.get("avtr_check_a", "check_a") is not None
+                      and not mismatches(saved, {p.rawName: p.value for p in manager.store.get("avtr_check_a", "check_a").parameters}))
+
+        print("apply:")
+        await asyncio.sleep(0.2) # the mirror settles on the echoes of the save reads
+        changed = changed_preset(saved, "check_a_changed", 5)
+        result = await manager.apply_latest_async(changed)
+        await asyncio.sleep(0.2)
+        checker.check("apply sends the changed values only", result is not None and len(result.sent) == 5, repr(result))
+        wrong = mismatches(changed, sim.avatars["avtr_check_a"])
+        checker.check("the game has the preset values", not wrong, f"wrong: {wrong[:5]}")
+
+        print("switch:")
+        other = changed_preset(avatar_preset(manager, sim, "avtr_check_b", "check_b"), "check_b", 10)
+        result = await manager.apply_latest_async(other)
+        await asyncio.sleep(0.2)
+        wrong = mismatches(other, sim.avatars["avtr_check_b"])
+        checker.check("the game switched and has the preset values", sim.avatarId == "avtr_check_b" and not wrong,
+                      f"on {sim.avatarId}, wrong: {wrong[:5]}")
+
+        print("supersede:")
+        # every sequence starts with a switch, the game is on B here
+        for label, order in (("on B: A, B", [changed, other]), ("on B: A, B, A", [changed, other, saved]), ("on A: B, A", [other, saved])):
+            pending = []
+            for preset in order[:-1]:
+                pending.append(asyncio.ensure_future(manager.apply_latest_async(preset)))
+                await asyncio.sleep(args.switch_delay / 5) # well before the switch lands
+            last = order[-1]
+            result = await manager.apply_latest_async(last)
+            results = await asyncio.gather(*pending)
+            await asyncio.sleep(args.switch_delay * 2) # a switch sent by a superseded apply would have landed by now
+            wrong = mismatches(last, sim.avatars[last.avatarId])
+            checker.check(f"{label}: the last apply wins", result is not None and sim.avatarId == last.avatarId and not wrong,
+                          f"{result!r}, on {sim.avatarId}, wrong: {wrong[:5]}")
+            checker.check(f"{label}: the older applies are superseded", all(r is None for r in results), repr(results))
+    finally:
+        manager.writer.close()
+        manager.store.close()
+        client.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--params", type=int, default=200, help="parameters per avatar")
+    parser.add_argument("--switch-delay", type=float, default=0.5, help="seconds the simulator takes to load an avatar")
+    parser.add_argument("--osc-port", type=int, default=9000, help="simulator OSC port")
+    parser.add_argument("--reply-port", type=int, default=9001, help="port the simulator answers on, the client listens there")
+    args = parser.parse_args()
+
+    checker = Checker()
+    avatars = {"avtr_check_a": synthetic_avatar(args.params, 1), "avtr_check_b": synthetic_avatar(args.params, 2)}
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["FLET_APP_STORAGE_DATA"] = tmp
+        with VRChatSimulator(avatars, switchDelay=args.switch_delay, oscPort=args.osc_port, replyPort=args.reply_port) as sim:
+            asyncio.run(run_checks(checker, sim, args))
+    print(f"{checker.passed} passed, {len(checker.failures)} failed")
+    sys.exit(1 if checker.failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""
+Benchmark suite for the capture, persist, load and apply hot paths, on synthetic avatar trees and preset libraries.
+Results are written as JSON so two runs can be compared, --compare fails (exit 1) when a case got slower than --threshold.
+
+    python benchmarks/run_benchmarks.py [--quick] [--only walk,library] [--output results.json]
+                                        [--compare baseline.json] [--threshold 0.25]
+
+Cases:
+    walk        walk_parameters / walk_node / read_live_values on a /avatar/parameters node, 100 to 10k parameters
+    capture     get_avatar_params over OSCQuery from the simulator, without listener so every call fetches
+    preset      AvatarPreset.to_dict / from_dict and presetCodec encode / decode
+    library     parse_existing_presets importing a presets/ directory, then warm startups and loading every preset, 10 to 10k presets
+    apply       apply_avatar_state_by_preset end to end against the simulator: changed values, nothing to send, avatar switch
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from FitCheck import presetCodec
+from FitCheck.avatarParameter import AvatarParameter
+from FitCheck.avatarPreset import AvatarPreset
+from FitCheck.vrcClient import VRCClient, walk_parameters, walk_node, read_live_values
+from bench_memory import synthetic_preset_dict
+from bench_walk import synthetic_parameters_node
+from vrc_simulator import VRChatSimulator, synthetic_avatar
+
+SIZES = {
+    "full": {"params": [100, 1000, 10000], "presets": [10, 100, 1000, 10000]},
+    "quick": {"params": [100, 1000], "presets": [10, 100, 1000]},
+}
+
+class Suite():
+    def __init__(self, repeat: int):
+        """
+        Collects the samples of every case, one result per (case, size).
+        """
+        self.repeat = repeat
+        self.results = []
+        pass
+
+    def measure(self, case: str, size: int, fn, repeat: int | None = None, setup=None, **extra) -> dict:
+        """
+        Times fn repeat times (setup, untimed, runs before each call) and records min/median/mean in seconds.
+        """
+        samples = []
+        for _ in range(repeat or self.repeat):
+            if setup:
+                setup()
+            start = time.perf_counter()
+            fn()
+            samples.append(time.perf_counter() - start)
+        return self.record(case, size, samples, **extra)
+
+    def record(self, case: str, size: int, samples: list[float], **extra) -> dict:
+        result = {
+            "case": case,
+            "size": size,
+            "repeat": len(samples),
+            "min": min(samples),
+            "median": statistics.median(samples),
+            "mean": statistics.fmean(samples),
+            **extra,
+        }
+        self.results.append(result)
+        print(f"  {case:<36} {size:>6} {result['median'] * 1000:10.3f} ms  (min {result['min'] * 1000:.3f})")
+        return result
+
+# ----- cases -----
+
+def bench_walk(suite: Suite, sizes: dict, args):
+    for count in sizes["params"]:
+        node = synthetic_parameters_node(count)
+        suite.measure("walk.walk_parameters", count, lambda: walk_parameters(node))
+        suite.measure("walk.walk_parameters_meta", count, lambda: walk_parameters(node, with_meta=True))
+        suite.measure("walk.walk_node", count, lambda: list(walk_node(node, "/avatar/parameters")))
+        suite.measure("walk.read_live_values", count, lambda: read_live_values(node))
+
+def bench_capture(suite: Suite, sizes: dict, args):
+    for count in sizes["params"]:
+        with VRChatSimulator({"avtr_bench": synthetic_avatar(count)}, oscPort=args.osc_port, replyPort=args.reply_port) as sim:
+            client = VRCClient(sim.oscqPort)
+            client.nodeCacheTtl = 0 # every call goes to the game
+            try:
+                suite.measure("capture.get_avatar_params", count, client.get_avatar_params, setup=client.invalidate_cache)
+                suite.measure("capture.get_avatar_params_meta", count, lambda: client.get_avatar_params(with_meta=True), setup=client.invalidate_cache)
+            finally:
+                client.close()
+
+def bench_preset(suite: Suite, sizes: dict, args):
+    for count in sizes["params"]:
+        data = synthetic_preset_dict("avtr_bench", "Bench", count, 1)
+        preset = AvatarPreset.from_dict(data)
+        blob = presetCodec.encode(preset)
+        suite.measure("preset.to_dict", count, preset.to_dict)
+        suite.measure("preset.from_dict", count, lambda: AvatarPreset.from_dict(data))
+        suite.measure("preset.encode", count, lambda: presetCodec.encode(preset), bytes=len(blob))
+        suite.measure("preset.decode", count, lambda: presetCodec.decode(blob))
+
+def write_library(presetsDir: Path, presets: int, params: int, avatars: int):
+    # the legacy layout, presets/<avatarId>/<name>.json, pretty printed like the old versions wrote them
+    for n in range(presets):
+        avatarId = f"avtr_{n % avatars:08d}"
+        folder = presetsDir / avatarId
+        folder.mkdir(parents=True, exist_ok=True)
+        (folder / f"Preset {n}.json").write_text(json.dumps(synthetic_preset_dict(avatarId, f"Preset {n}", params, n), indent=2))
+
+def bench_library(suite: Suite, sizes: dict, args):
+    from FitCheck.avatarManager import AvatarManager
+    for count in sizes["presets"]:
+        with tempfile.TemporaryDirectory() as tmp:
+            os.environ["FLET_APP_STORAGE_DATA"] = tmp
+            write_library(Path(tmp) / "presets", count, args.library_params, args.avatars)
+            managers = []
+            def startup():
+                manager = AvatarManager(client=None)
+                manager.parse_existing_presets()
+                managers.append(manager)
+            def release():
+                while managers:
+                    manager = managers.pop()
+                    manager.writer.close() # compacts in the background, not part of the startup
+                    manager.store.close()
+            suite.measure("library.import", count, startup, repeat=1, params=args.library_params)
+            release()
+            suite.measure("library.startup", count, startup, setup=release, params=args.library_params)
+            manager = managers[-1]
+            keys = [(avatarId, name) for avatarId, presets in manager.presets.items() for name in presets]
+            def load_all():
+                manager.presetCache.clear()
+                for avatarId, name in keys:
+                    manager.find_avatar_preset(avatarId, name)
+            suite.measure("library.load_all", count, load_all, params=args.library_params)
+            release()
+
+def bench_apply(suite: Suite, sizes: dict, args):
+    from FitCheck.avatarManager import AvatarManager
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["FLET_APP_STORAGE_DATA"] = tmp
+        for count in sizes["params"][:2]: # past 1000 parameters this measures the simulator
+            avatars = {"avtr_bench_a": synthetic_avatar(count, 1), "avtr_bench_b": synthetic_avatar(count, 2)}
+            sim = VRChatSimulator(avatars, switchDelay=args.switch_delay, oscPort=args.osc_port, replyPort=args.reply_port)
+            with sim:
+                client = VRCClient(sim.oscqPort)
+                client.listenPort = args.reply_port
+                client.start_listener()
+                manager = AvatarManager(client)
+                try:
+                    client.sync_mirror()
+                    current = manager.save_avatar_state("current")
+                    changed = AvatarPreset("changed", current.avatarId, [
+                        AvatarParameter(p.name, p.path, (not p.value) if isinstance(p.value, bool) else p.value + 1, p.rawName)
+                        for p in current.parameters
+                    ], current.filterKey)
+                    presets = [changed, current]
+                    def apply_changed():
+                        manager.apply_avatar_state_by_preset(presets[0])
+                        presets.reverse()
+                    suite.measure("apply.changed", count, apply_changed, sent=len(changed.parameters))
+                    manager.apply_avatar_state_by_preset(current)
+                    settle = lambda: time.sleep(0.2) # echoes of the previous apply reach the mirror
+                    suite.measure("apply.nothing_to_send", count, lambda: manager.apply_avatar_state_by_preset(current), setup=settle)
+                    other = AvatarPreset("other", "avtr_bench_b", current.parameters, current.filterKey)
+                    targets = [other, current]
+                    def apply_switch():
+                        manager.apply_avatar_state_by_preset(targets[0])
+                        targets.reverse()
+                    suite.measure("apply.switch", count, apply_switch, repeat=max(2, suite.repeat // 5), switchDelay=args.switch_delay)
+                finally:
+                    manager.writer.close()
+                    manager.store.close()
+                    client.close()
+
+CASES = {
+    "walk": bench_walk,
+    "capture": bench_capture,
+    "preset": bench_preset,
+    "library": bench_library,
+    "apply": bench_apply,
+}
+
+# ----- results -----
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results: list[dict], baselinePath: str, threshold: float) -> list[str]:
+    """
+    Returns a line for every case whose median got slower than the baseline by more than threshold (0.25 = 25%).
+    """
+    baseline = {(r["case"], r["size"]): r for r in json.loads(Path(baselinePath).read_text())["results"]}
+    regressions = []
+    for result in results:
+        before = baseline.get((result["case"], result["size"]))
+        if not before or before["median"] <= 0:
+            continue
+        ratio = result["median"] / before["median"]
+        if ratio > 1 + threshold:
+            regressions.append(f"{result['case']} [{result['size']}]: {before['median'] * 1000:.3f} -> {result['median'] * 1000:.3f} ms (x{ratio:.2f})")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quick", action="store_true", help="smaller sizes, for a run in a few seconds")
+    parser.add_argument("--only", help="comma separated cases, all by default")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--library-params", type=int, default=100, help="parameters per preset of the synthetic libraries")
+    parser.add_argument("--avatars", type=int, default=10, help="avatars the synthetic libraries are spread over")
+    parser.add_argument("--switch-delay", type=float, default=0.2, help="seconds the simulator takes to load an avatar")
+    parser.add_argument("--osc-port", type=int, default=9000, help="simulator OSC port")
+    parser.add_argument("--reply-port", type=int, default=9001, help="port the simulator answers on, the client listens there")
+    parser.add_argument("--output", help="write the results as JSON there")
+    parser.add_argument("--compare", help="results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25)
+    args = parser.parse_args()
+
+    sizes = SIZES["quick" if args.quick else "full"]
+    cases = args.only.split(",") if args.only else list(CASES)
+    unknown = [c for c in cases if c not in CASES]
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(unknown)}")
+
+    suite = Suite(args.repeat)
+    for name in cases:
+        print(f"{name}:")
+        CASES[name](suite, sizes, args)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "sizes": "quick" if args.quick else "full",
+            "repeat": args.repeat,
+            "libraryParams": args.library_params,
+        },
+        "results": suite.results,
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+        print(f"results written to {args.output}")
+    if args.compare:
+        regressions = compare(suite.results, args.compare, args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"no regression over {args.threshold:.0%} against {args.compare}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""
+Stand-in for VRChat's OSC/OSCQuery side, so the client can be run, measured and checked on any OS without the game.
+
+- OSCQuery: the avatar tree over HTTP (whole tree, per path queries, ?HOST_INFO) on an ephemeral port like the game.
+- OSC in on 9000: /avatar/change switches avatar after --switch-delay and floods every parameter back on 9001,
+  parameter messages set the value and are echoed back after --echo-delay.
+- Every outgoing message is dropped with probability --drop, from a seeded random generator.
+- --advertise announces the OSCQuery service over zeroconf, the way FitCheck discovers the game.
+
+    python benchmarks/vrc_simulator.py [--params 300] [--avatars 3] [--switch-delay 1.0] [--drop 0.0] [--advertise]
+"""
+import argparse
+import json
+import random
+import socket
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+from pythonosc.osc_message_builder import build_msg
+from pythonosc.osc_packet import OscPacket, ParseError
+
+PARAMETERS_PREFIX = "/avatar/parameters/"
+
+def synthetic_avatar(params: int, seed: int = 0, nested_every: int = 10) -> dict:
+    """
+    {rawName: value} for an avatar with params parameters, a mix of bools, ints and floats,
+    every nested_every-th one under FT/v2/ like face tracking parameters.
+    """
+    rng = random.Random(seed)
+    avatar = {}
+    for i in range(params):
+        rawName = f"FT/v2/Face_{i:04d}" if nested_every and i % nested_every == 0 else f"Toggle_{i:04d}"
+        kind = i % 3
+        avatar[rawName] = rng.random() < 0.5 if kind == 0 else (rng.randrange(8) if kind == 1 else round(rng.random(), 3))
+    return avatar
+
+def osc_type(value) -> str:
+    if isinstance(value, bool):
+        return "T" if value else "F"
+    return "i" if isinstance(value, int) else "f"
+
+class VRChatSimulator():
+    def __init__(self, avatars: dict | None = None, params: int = 300, host: str = "127.0.0.1", oscPort: int = 9000,
+                 replyPort: int = 9001, oscqPort: int = 0, switchDelay: float = 1.0, floodInterval: float = 0.0,
+                 echoDelay: float = 0.0, dropRate: float = 0.0, seed: int = 0, advertise: bool = False):
+        """
+        avatars maps avatarId -> {rawName: value}. An /avatar/change to an unknown id makes one with params parameters.
+        The first avatar is worn at start. Delays are in seconds, oscqPort 0 picks a free port.
+        """
+        self.host = host
+        self.oscPort = oscPort
+        self.replyPort = replyPort
+        self.oscqPort = oscqPort
+        self.params = params
+        self.switchDelay = switchDelay
+        self.floodInterval = floodInterval # pause between two flooded parameters, 0 sends them back to back
+        self.echoDelay = echoDelay
+        self.dropRate = dropRate
+        self.advertise = advertise
+        self.avatars = avatars if avatars is not None else {"avtr_sim_0": synthetic_avatar(params)}
+        self.avatarId = next(iter(self.avatars))
+        self.stats = {"oscReceived": 0, "oscSent": 0, "oscDropped": 0, "httpRequests": 0, "switches": 0}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._switchSerial = 0
+        self._stopped = threading.Event()
+        self._http: ThreadingHTTPServer | None = None
+        self._osc: socket.socket | None = None
+        self._out = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._threads: list[threading.Thread] = []
+        self._zeroconf = None
+        self._serviceInfo = None
+        pass
+
+    # ----- lifecycle -----
+    def start(self):
+        self._http = ThreadingHTTPServer((self.host, self.oscqPort), self._handler())
+        self._http.daemon_threads = True
+        self.oscqPort = self._http.server_address[1]
+        self._osc = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._osc.bind((self.host, self.oscPort))
+        self._osc.settimeout(0.2)
+        for target in (self._http.serve_forever, self._receive):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        if self.advertise:
+            self._advertise()
+        print(f"[sim] OSCQuery on http://{self.host}:{self.oscqPort}, OSC on {self.oscPort}, replies to {self.replyPort}")
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._zeroconf:
+            self._zeroconf.unregister_service(self._serviceInfo)
+            self._zeroconf.close()
+            self._zeroconf = None
+        if self._http:
+            self._http.shutdown()
+            self._http.server_close()
+            self._http = None
+        for thread in self._threads:
+            thread.join(1)
+        if self._osc:
+            self._osc.close()
+            self._osc = None
+        self._out.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _advertise(self):
+        from zeroconf import Zeroconf, ServiceInfo
+        name = f"VRChat-Client-{self._rng.randrange(16**6):06X}"
+        self._serviceInfo = ServiceInfo(
+            "_oscjson._tcp.local.", f"{name}._oscjson._tcp.local.",
+            addresses=[socket.inet_aton(self.host)], port=self.oscqPort, server=f"{name}.local.",
+        )
+        self._zeroconf = Zeroconf()
+        self._zeroconf.register_service(self._serviceInfo)
+
+    # ----- OSC -----
+    def _receive(self):
+        while not self._stopped.is_set():
+            try:
+                data, _ = self._osc.recvfrom(65535)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            try:
+                messages = OscPacket(data).messages
+            except ParseError:
+                continue
+            for timed in messages:
+                msg = timed.message
+                self.stats["oscReceived"] += 1
+                if msg.address == "/avatar/change" and msg.params:
+                    self.switch_avatar(str(msg.params[0]))
+                elif msg.address.startswith(PARAMETERS_PREFIX) and msg.params:
+                    self.set_parameter(msg.address[len(PARAMETERS_PREFIX):], msg.params[0])
+
+    def _send(self, address: str, value):
+        if self.dropRate and self._rng.random() < self.dropRate:
+            self.stats["oscDropped"] += 1
+            return
+        self._out.sendto(build_msg(address, value).dgram, (self.host, self.replyPort))
+        self.stats["oscSent"] += 1
+
+    def switch_avatar(self, avatarId: str):
+        """
+        Like the game: after switchDelay the new avatar is worn, /avatar/change goes out, then every parameter.
+        A newer switch cancels the flood of an older one.
+        """
+        with self._lock:
+            self._switchSerial += 1
+            serial = self._switchSerial
+            self.stats["switches"] += 1
+        def load():
+            if self._stopped.wait(self.switchDelay):
+                return
+            with self._lock:
+                if serial != self._switchSerial:
+                    return
+                if avatarId not in self.avatars:
+                    self.avatars[avatarId] = synthetic_avatar(self.params, seed=len(self.avatars))
+                self.avatarId = avatarId
+                values = list(self.avatars[avatarId].items())
+            self._send("/avatar/change", avatarId)
+            for rawName, value in values:
+                if serial != self._switchSerial or self._stopped.is_set():
+                    return
+                self._send(PARAMETERS_PREFIX + rawName, value)
+                if self.floodInterval:
+                    time.sleep(self.floodInterval)
+        threading.Thread(target=load, daemon=True).start()
+
+    def set_parameter(self, rawName: str, value):
+        with self._lock:
+            avatar = self.avatars[self.avatarId]
+            if rawName not in avatar:
+                return # the game ignores parameters the avatar doesn't have
+            avatar[rawName] = value
+        if self.echoDelay:
+            threading.Timer(self.echoDelay, self._send, (PARAMETERS_PREFIX + rawName, value)).start()
+        else:
+            self._send(PARAMETERS_PREFIX + rawName, value)
+
+    # ----- OSCQuery -----
+    def tree(self) -> dict:
+        with self._lock:
+            avatarId = self.avatarId
+            values = list(self.avatars[avatarId].items())
+        parameters = {"FULL_PATH": "/avatar/parameters", "ACCESS": 0, "CONTENTS": {}}
+        for rawName, value in values:
+            node = parameters
+            parts = rawName.split("/")
+            for depth, part in enumerate(parts[:-1]):
+                node = node["CONTENTS"].setdefault(part, {
+                    "FULL_PATH": PARAMETERS_PREFIX + "/".join(parts[:depth + 1]), "ACCESS": 0, "CONTENTS": {},
+                })
+            node["CONTENTS"][parts[-1]] = {
+                "FULL_PATH": PARAMETERS_PREFIX + rawName, "ACCESS": 3, "TYPE": osc_type(value), "VALUE": [value],
+            }
+        change = {"FULL_PATH": "/avatar/change", "ACCESS": 3, "TYPE": "s", "VALUE": [avatarId]}
+        avatar = {"FULL_PATH": "/avatar", "ACCESS": 0, "CONTENTS": {"change": change, "parameters": parameters}}
+        return {"FULL_PATH": "/", "ACCESS": 0, "CONTENTS": {"avatar": avatar}}
+
+    def host_info(self) -> dict:
+        return {
+            "NAME": "VRChat-Client-Simulator", "OSC_IP": self.host, "OSC_PORT": self.oscPort, "OSC_TRANSPORT": "UDP",
+            "EXTENSIONS": {"ACCESS": True, "CLIPMODE": False, "RANGE": True, "TYPE": True, "VALUE": True},
+        }
+
+    def node(self, path: str) -> dict | None:
+        node = self.tree()
+        for part in [p for p in path.strip("/").split("/") if p]:
+            node = node.get("CONTENTS", {}).get(part)
+            if node is None:
+                return None
+        return node
+
+    def _handler(self):
+        sim = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                sim.stats["httpRequests"] += 1
+                url = urlsplit(self.path)
+                data = sim.host_info() if url.query == "HOST_INFO" else sim.node(url.path)
+                if data is None:
+                    self.send_error(404)
+                    return
+                body = json.dumps(data).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, *args):
+                pass
+        return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--params", type=int, default=300, help="parameters per avatar")
+    parser.add_argument("--avatars", type=int, default=3)
+    parser.add_argument("--switch-delay", type=float, default=1.0)
+    parser.add_argument("--flood-interval", type=float, default=0.0)
+    parser.add_argument("--echo-delay", type=float, default=0.0)
+    parser.add_argument("--drop", type=float, default=0.0, help="probability of dropping each outgoing message")
+    parser.add_argument("--oscq-port", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--advertise", action="store_true", help="announce the OSCQuery service over zeroconf")
+    args = parser.parse_args()
+
+    avatars = {f"avtr_sim_{n}": synthetic_avatar(args.params, seed=n) for n in range(args.avatars)}
+    sim = VRChatSimulator(
+        avatars, params=args.params, oscqPort=args.oscq_port, switchDelay=args.switch_delay, floodInterval=args.flood_interval,
+        echoDelay=args.echo_delay, dropRate=args.drop, seed=args.seed, advertise=args.advertise,
+    )
+    with sim:
+        print(f"[sim] avatars: {', '.join(avatars)}, Ctrl+C to stop")
+        try:
+            while True:
+                time.sleep(5)
+                print(f"[sim] {sim.stats}")
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == "__main__":
+    main()
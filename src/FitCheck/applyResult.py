@@ -0,0 +1,23 @@
+class ApplyResult():
+    def __init__(self, presetName: str, avatarId: str):
+        """
+        Summary of a preset apply: which parameters were sent, which were already at the preset value, and which were blacklisted.
+        """
+        self.presetName = presetName
+        self.avatarId = avatarId
+        self.sent: list[str] = []
+        self.skipped: list[str] = [] # live value already matched the preset
+        self.blacklisted: list[str] = []
+        self.bundles = 0
+        pass
+    def __repr__(self):
+        return f"ApplyResult(preset={self.presetName!r}, sent={len(self.sent)}, skipped={len(self.skipped)}, blacklisted={len(self.blacklisted)}, bundles={self.bundles})"
+    def to_dict(self):
+        return {
+            "presetName": self.presetName,
+            "avatarId": self.avatarId,
+            "sent": self.sent,
+            "skipped": self.skipped,
+            "blacklisted": self.blacklisted,
+            "bundles": self.bundles,
+        }
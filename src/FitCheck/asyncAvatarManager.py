@@ -0,0 +1,164 @@
+import asyncio
+from typing import Callable
+from FitCheck.avatarManager import AvatarManager
+from FitCheck.avatarPreset import AvatarPreset
+from FitCheck.applyResult import ApplyResult
+from FitCheck.asyncVrcClient import AsyncVRCClient
+from FitCheck.logger import log
+from FitCheck.profiling import profiled
+from FitCheck.metrics import metrics
+
+class AsyncAvatarManager(AvatarManager):
+    """
+    AvatarManager whose operations that wait on the game can be awaited from the UI loop, cancelled, and report their progress.
+    Library operations (find, rename, delete...) stay as they are, they never wait on the game nor on the disk.
+    With a plain VRCClient the blocking versions run in a worker thread instead.
+    """
+
+    def __init__(self, client: AsyncVRCClient):
+        super().__init__(client)
+        self._applySwitchLock = asyncio.Lock() # avatar switches of the loop, one at a time
+        self._wantedApply: ApplyRequest | None = None # newest apply not started yet
+        self._currentApply: ApplyRequest | None = None
+        self._applyStep: asyncio.Task | None = None # switch or send of _currentApply
+        self._applyRunner: asyncio.Task | None = None
+        pass
+
+    async def get_avatar_id_async(self) -> str:
+        if isinstance(self.vrcclient, AsyncVRCClient):
+            return await self.vrcclient.get_avatar_id_async()
+        return await asyncio.to_thread(self.vrcclient.get_avatar_id)
+
+    @profiled("save_avatar_state")
+    async def save_avatar_state_async(self, presetName: str, progress: Callable[[str], None] | None = None) -> AvatarPreset:
+        client = self.vrcclient
+        if not isinstance(client, AsyncVRCClient):
+            return await asyncio.to_thread(self.save_avatar_state, presetName)
+        if progress:
+            progress("Reading the avatar state")
+        with metrics.timer("save.total"):
+            avatarId = await client.get_avatar_id_async()
+            with metrics.timer("save.read_params"):
+                avatarState = self.blacklist.filter(await client.get_avatar_params_async())
+            preset = AvatarPreset(presetName, avatarId, avatarState, self.blacklist.key)
+            self.save_avatar_state_from_preset(preset)
+        return preset
+
+    @profiled("apply_avatar_state_by_preset")
+    async def apply_avatar_state_by_preset_async(self, preset: AvatarPreset, progress: Callable[[str], None] | None = None) -> ApplyResult:
+        """
+        Switches avatar if needed, waits for it to load and sends the preset. Cancelling stops between two steps,
+        or between two bundles, nothing more is sent after that.
+        """
+        client = self.vrcclient
+        if not isinstance(client, AsyncVRCClient):
+            return await asyncio.to_thread(self.apply_avatar_state_by_preset, preset)
+        with metrics.timer("apply.total"):
+            await self._switch_avatar_async(preset.avatarId, progress)
+            return await self.send_preset_parameters_async(preset, progress)
+
+    async def _switch_avatar_async(self, avatarId: str, progress: Callable[[str], None] | None = None):
+        client = self.vrcclient
+        async with self._applySwitchLock:
+            with metrics.timer("apply.get_avatar_id"):
+                currentAvatarId = await client.get_avatar_id_async()
+            if currentAvatarId == avatarId and client.pendingAvatarId is None:
+                return # a switch that was cancelled or never confirmed may still land, then the avatar isn't known
+            if progress:
+                progress(f"Switching to avatar {avatarId}")
+            metrics.inc("apply.switches")
+            with metrics.timer("apply.switch"):
+                await client.change_avatar_async(avatarId)
+                await client.wait_for_avatar_ready_async(min_params=1, avatar_id=avatarId, progress=progress)
+
+    @profiled("apply_avatar_state_by_preset")
+    async def apply_latest_async(self, preset: AvatarPreset, progress: Callable[[str], None] | None = None) -> ApplyResult | None:
+        """
+        Applies like apply_avatar_state_by_preset_async, but the last request wins: a newer one supersedes this one
+        whether it's still waiting, switching avatar or sending. A switch to the avatar the newer request wants is kept,
+        sending stops at the next bundle. Returns None when superseded, the ApplyResult otherwise.
+        """
+        client = self.vrcclient
+        if not isinstance(client, AsyncVRCClient):
+            return await asyncio.to_thread(self.apply_avatar_state_by_preset, preset)
+        request = ApplyRequest(preset, progress)
+        if self._wantedApply:
+            self._wantedApply.finish(None)
+        self._wantedApply = request
+        current = self._currentApply
+        if current and self._applyStep and not self._applyStep.done():
+            if current.stage != "switching" or current.preset.avatarId != preset.avatarId:
+                current.superseded = True
+                self._applyStep.cancel()
+        if self._applyRunner is None or self._applyRunner.done():
+            self._applyRunner = asyncio.ensure_future(self._run_applies())
+        try:
+            with metrics.timer("apply.total"): # from the click, waiting behind older requests included
+                return await asyncio.shield(request.done)
+        except asyncio.CancelledError:
+            # the caller gave up on this one, stop it wherever it is
+            if self._wantedApply is request:
+                self._wantedApply = None
+            elif self._currentApply is request and self._applyStep:
+                request.superseded = True
+                self._applyStep.cancel()
+            request.finish(None)
+            raise
+
+    async def _run_applies(self):
+        while self._wantedApply:
+            request = self._wantedApply
+            self._wantedApply = None
+            self._currentApply = request
+            preset = request.preset
+            try:
+                request.stage = "switching"
+                self._applyStep = asyncio.ensure_future(self._switch_avatar_async(preset.avatarId, request.progress))
+                await self._applyStep
+                if self._wantedApply and self._wantedApply.preset.avatarId == preset.avatarId:
+                    request.finish(None) # a newer preset for this avatar came in while it loaded, it's sent instead
+                    continue
+                request.stage = "sending"
+                self._applyStep = asyncio.ensure_future(self.send_preset_parameters_async(preset, request.progress))
+                request.finish(await self._applyStep)
+            except asyncio.CancelledError:
+                if not request.superseded:
+                    request.finish(None)
+                    raise
+                log.info("apply", "%s superseded while %s", preset.name, request.stage)
+                metrics.inc("apply.superseded")
+                request.finish(None)
+            except Exception as exc:
+                request.fail(exc)
+            finally:
+                self._currentApply = None
+                self._applyStep = None
+
+    async def send_preset_parameters_async(self, preset: AvatarPreset, progress: Callable[[str], None] | None = None) -> ApplyResult:
+        client = self.vrcclient
+        with metrics.timer("apply.read_live"):
+            live = await client.get_live_values_async(resync=True)
+        result, changes = self._plan_apply(preset, live)
+        if changes:
+            with metrics.timer("apply.send"):
+                result.bundles = await client.send_param_changes_async(changes, progress=progress)
+        self._record_apply(result)
+        return result
+
+class ApplyRequest():
+    def __init__(self, preset: AvatarPreset, progress: Callable[[str], None] | None):
+        """
+        One call of apply_latest_async, done resolves to its ApplyResult, or None if it was superseded.
+        """
+        self.preset = preset
+        self.progress = progress
+        self.stage = "waiting"
+        self.superseded = False
+        self.done = asyncio.get_running_loop().create_future()
+        pass
+    def finish(self, result):
+        if not self.done.done():
+            self.done.set_result(result)
+    def fail(self, exc: Exception):
+        if not self.done.done():
+            self.done.set_exception(exc)
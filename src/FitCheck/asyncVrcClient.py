@@ -0,0 +1,174 @@
+import asyncio
+import time
+from typing import Callable
+from pythonosc.dispatcher import Dispatcher
+from pythonosc.osc_message_builder import build_msg
+from pythonosc.osc_server import AsyncIOOSCUDPServer
+from FitCheck.avatarParameter import AvatarParameter, PARAMETERS_PREFIX
+from FitCheck.vrcClient import VRCClient, ReadyCondition, build_bundles
+from FitCheck.logger import log
+
+class AsyncVRCClient(VRCClient):
+    def __init__(self, oscqPort: int, loop: asyncio.AbstractEventLoop | None = None):
+        """
+        VRCClient for an asyncio event loop (the one of the UI): the OSC listener is a datagram endpoint on loop,
+        and everything that waits on the game has an awaitable version, the *_async methods, which can be cancelled.
+        The blocking methods keep working from other threads.
+        """
+        super().__init__(oscqPort)
+        self.loop = loop
+        self._transport: asyncio.DatagramTransport | None = None
+        self._wakers: set[asyncio.Future] = set() # resolved whenever the listener sees something readiness waiters care about
+        pass
+    def start_listener(self):
+        """
+        Opens the OSC endpoint on loop from another thread. Raises OSError if the port is taken.
+        """
+        if self._transport is not None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is not None and running is self.loop:
+            raise RuntimeError("start_listener would block the loop, await start_async() instead")
+        asyncio.run_coroutine_threadsafe(self.start_async(), self.loop).result()
+    async def start_async(self):
+        if self._transport is not None:
+            return
+        self.loop = asyncio.get_running_loop()
+        disp = Dispatcher()
+        disp.map("/avatar/change", self._on_avatar_change)
+        disp.set_default_handler(self._on_osc_message)
+        self._transport, _ = await AsyncIOOSCUDPServer((self.ip, self.listenPort), disp, self.loop).create_serve_endpoint()
+    def stop_listener(self):
+        transport, self._transport = self._transport, None
+        if transport is None:
+            return
+        self.loop.call_soon_threadsafe(transport.close)
+        with self._mirrorLock:
+            self.mirrorSeeded = False
+    def is_listening(self) -> bool:
+        return self._transport is not None
+    def _on_avatar_change(self, addr, *args):
+        super()._on_avatar_change(addr, *args)
+        self._wake()
+    def _on_osc_message(self, addr, *args):
+        seen = len(self._seenSinceChange)
+        super()._on_osc_message(addr, *args)
+        if len(self._seenSinceChange) != seen: # only new names move readiness
+            self._wake()
+    def _wake(self):
+        # runs on the loop, from the datagram endpoint
+        for waker in self._wakers:
+            if not waker.done():
+                waker.set_result(None)
+    def _send(self, content):
+        # the listening socket sends too, VRChat doesn't care where messages come from
+        if self._transport is not None:
+            self._transport.sendto(content.dgram, (self.ip, self.port))
+        else:
+            self.client.send(content)
+    async def send_param_changes_async(self, params, max_bundle_size: int | None = None, interval: float | None = None,
+                                       progress: Callable[[str], None] | None = None) -> int:
+        """
+        send_param_changes for the loop: sleeps between bundles without blocking it, and stops there when cancelled.
+        Returns the number of bundles sent.
+        """
+        maxSize = self.bundleMaxSize if max_bundle_size is None else max_bundle_size
+        pause = self.bundleInterval if interval is None else interval
+        bundles = list(build_bundles(params, maxSize))
+        for sent, bundle in enumerate(bundles):
+            if sent and pause > 0:
+                await asyncio.sleep(pause)
+            self._send(bundle)
+            if progress:
+                progress(f"Sent {sent + 1}/{len(bundles)} bundles")
+        return len(bundles)
+    async def change_avatar_async(self, avatarId: str):
+        self.invalidate_cache()
+        with self._mirrorLock:
+            self._switchSerial = self._changeSerial
+            self.pendingAvatarId = avatarId
+        self._send(build_msg("/avatar/change", avatarId))
+    # OSCQuery goes through the blocking methods in a worker thread: one pooled session, one node cache,
+    # one set of validators and path query fallbacks for both clients. Cancelling stops waiting, the request finishes in its thread.
+    async def fetch_node_async(self, path: str, max_age: float | None = None):
+        return await asyncio.to_thread(self.fetch_node, path, max_age)
+    async def get_node_async(self, path: str, max_age: float | None = None):
+        return await asyncio.to_thread(self.get_node, path, max_age)
+    async def sync_mirror_async(self, max_age: float | None = None):
+        await asyncio.to_thread(self.sync_mirror, max_age)
+    async def ensure_mirror_async(self):
+        await asyncio.to_thread(self.ensure_mirror)
+    async def get_avatar_id_async(self) -> str:
+        return await asyncio.to_thread(self.get_avatar_id)
+    async def get_avatar_params_async(self, with_meta=False) -> list[AvatarParameter]:
+        return await asyncio.to_thread(self.get_avatar_params, with_meta)
+    async def get_live_values_async(self, resync: bool = False) -> dict:
+        return await asyncio.to_thread(self.get_live_values, resync)
+    async def probe_async(self, timeout: float | None = None) -> bool:
+        return await asyncio.to_thread(self.probe, timeout)
+    async def wait_for_avatar_ready_async(self, timeout=60, min_params=10, quiet_ms=400, required_params=None, avatar_id=None,
+                                          progress: Callable[[str], None] | None = None):
+        """
+        wait_for_avatar_ready for the loop, woken up by the listener instead of a condition variable.
+        Reports each step to progress. Returns avatar_id, raises TimeoutError on timeout.
+        """
+        await self.start_async()
+        required = set(PARAMETERS_PREFIX + name for name in (required_params or []))
+        waiter = ReadyCondition(min_params, required)
+        quiet = quiet_ms / 1000.0
+        deadline = time.monotonic() + timeout
+        with self._mirrorLock:
+            baseline = self._switchSerial if self._switchSerial is not None else self._changeSerial
+            self._switchSerial = None
+            self._readyWaiters.append(waiter)
+            if self._changeSerial > baseline:
+                waiter.check(self._seenSinceChange) # the change and its flood may have landed before we got here
+        step = ""
+        wasWaiting = None
+        reported = 0.0
+        try:
+            while True:
+                now = time.monotonic()
+                with self._mirrorLock:
+                    seen = len(self._seenSinceChange)
+                    waiting = self._changeSerial <= baseline or (avatar_id and self.liveAvatarId != avatar_id)
+                    if waiting:
+                        wake_at = deadline
+                        error = "No /avatar/change received within timeout"
+                        message = "Waiting for the avatar to change"
+                    elif not waiter.enough:
+                        wake_at = deadline
+                        error = "Avatar did not expose enough parameters in time"
+                        message = f"Avatar loading, {seen} parameters so far"
+                    else:
+                        quiet_end = self._lastNewNameTs + quiet
+                        if now >= quiet_end:
+                            readyId = self.liveAvatarId
+                            break
+                        wake_at = min(quiet_end, deadline)
+                        error = "Avatar did not expose enough parameters in time"
+                        message = f"Avatar loading, {seen} parameters so far"
+                if progress and message != step and (waiting != wasWaiting or now - reported >= 0.25): # counts at most 4 times a second
+                    progress(message)
+                    step = message
+                    wasWaiting = waiting
+                    reported = now
+                if now >= deadline:
+                    raise TimeoutError(error)
+                # not asyncio.wait_for, on 3.11 it can swallow a cancellation arriving with the wake up
+                waker = self.loop.create_future()
+                timer = self.loop.call_later(wake_at - now, lambda: waker.done() or waker.set_result(None))
+                self._wakers.add(waker)
+                try:
+                    await waker
+                finally:
+                    timer.cancel()
+                    self._wakers.discard(waker)
+        finally:
+            with self._mirrorLock:
+                self._readyWaiters.remove(waiter)
+        log.info("osc", "avatar %s ready with %d parameters", readyId, seen)
+        return readyId
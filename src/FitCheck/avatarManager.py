@@ -1,133 +1,320 @@
 import json
 import os
 import time
-import copy
+import threading
 from typing import Dict
 from pathlib import Path
 from FitCheck.avatarPreset import AvatarPreset
-from FitCheck.vrcClient import VRCClient
+from FitCheck.vrcClient import VRCClient, values_equal
+from FitCheck.applyResult import ApplyResult
 from FitCheck.settings import Settings
+from FitCheck.blacklist import Blacklist
+from FitCheck.presetStore import PresetStore
+from FitCheck.presetInfo import PresetInfo
+from FitCheck.lruCache import LRUCache
+from FitCheck.writeBehind import WriteBehind, atomic_write_text
+from FitCheck.logger import log
+from FitCheck.profiling import profiled
+from FitCheck.metrics import metrics
 
 class AvatarManager():
     def __init__(self, client: VRCClient):
         self.dataPath = Path(os.getenv("FLET_APP_STORAGE_DATA"))
         self.settings = self.load_settings()
-        self.blacklistIndividual: list[str] = self.settings.blacklistIndividual
-        self.blacklistPartial: list[str] = self.settings.blacklistPartial
-        self.presets: Dict[str, Dict[str, AvatarPreset]] = {}
+        self.blacklist = Blacklist.from_settings(self.settings)
+        self.presets: Dict[str, Dict[str, PresetInfo]] = {} # metadata only, parameters are loaded by find_avatar_preset
+        self.store = PresetStore(self.dataPath / "presets.db")
+        self.presetCache = LRUCache(32) # (avatarId, name) -> AvatarPreset
+        self._indexedVersion: int | None = None # store data_version self.presets was built from
+        self.writer = WriteBehind() # every disk write goes through it, callers never wait on the disk
+        self._pending: Dict[tuple, AvatarPreset] = {} # (avatarId, name) -> preset saved but not written yet
+        self._pendingDeletes: set = set() # (avatarId, name) deleted or renamed away, still in the store until the writer gets to it
+        self._pendingLock = threading.Lock()
         self.vrcclient = client
         self.preset_nums = 0
+        self._switchLock = threading.Lock() # one avatar switch at a time, a second one would be taken for the first
         pass
 
+    @profiled("parse_existing_presets")
     def parse_existing_presets(self) -> int:
         """
-        Returns the number of parsed presets
+        Loads every preset from the store, importing new files from the presets/ directory first. Returns the number of parsed presets
         """
-        path = self.dataPath / "presets"
-        
+        imported = self.store.import_directory(self.dataPath / "presets")
+        if imported:
+            log.info("store", "imported %d presets from the presets directory", len(imported))
+        self.writer.submit("compact", self.store.compact) # presets stored whole, turned into deltas in the background
+        self._indexedVersion = self.store.data_version()
         self.presets.clear()
-        if not path.exists():
-            path.mkdir()
-            return 0
-        for avatar_dir in sorted(p for p in path.iterdir() if p.is_dir() and not p.name.startswith(".")):
-            avatar_id = avatar_dir.name
-            presets: Dict[str, AvatarPreset] = {}
-            for blob in sorted(avatar_dir.glob("*.json")):
-                preset_name = blob.stem # test this
-                with blob.open() as file:
-                    data = json.load(file)
-                    presets[preset_name] = AvatarPreset.from_dict(data)
-                    self.preset_nums += 1
-            if presets:
-                self.presets[avatar_id] = presets
-        print(self.presets)
+        self.presetCache.clear()
+        for info in self.store.list_info():
+            self.presets.setdefault(info.avatarId, {})[info.name] = info
+        self.preset_nums = sum(len(presets) for presets in self.presets.values())
         return self.preset_nums
+
+    def refresh_presets(self) -> bool:
+        """
+        Picks up presets changed outside of this manager: new or edited files in presets/, and writes to the database by
+        another process. Only presets whose metadata changed are evicted from the cache. Returns whether anything changed.
+        Changes made through the manager are already in self.presets and don't need this. Never waits on the writer,
+        so the UI can call it while the disk is slow or failing.
+        """
+        if self._indexedVersion is None:
+            self.parse_existing_presets()
+            return True
+        imported = self.store.import_directory(self.dataPath / "presets")
+        version = self.store.data_version()
+        if not imported and version == self._indexedVersion:
+            return False
+        self._indexedVersion = version
+        # our writes still queued are laid over the store instead of waiting for them, taken before listing so a write
+        # finishing in between is seen on one side or the other
+        with self._pendingLock:
+            pending = list(self._pending)
+            deleting = set(self._pendingDeletes)
+        fresh: Dict[str, Dict[str, PresetInfo]] = {}
+        for info in self.store.list_info():
+            if (info.avatarId, info.name) not in deleting:
+                fresh.setdefault(info.avatarId, {})[info.name] = info
+        for avatarId, name in pending:
+            info = self.presets.get(avatarId, {}).get(name)
+            if info is not None:
+                fresh.setdefault(avatarId, {})[name] = info
+        for presets in fresh.values():
+            for info in presets.values():
+                old = self.presets.get(info.avatarId, {}).get(info.name)
+                if old is None or old.updatedAt != info.updatedAt or old.size != info.size:
+                    self.presetCache.pop((info.avatarId, info.name))
+        for avatarId, presets in self.presets.items():
+            for name in presets:
+                if name not in fresh.get(avatarId, {}):
+                    self.presetCache.pop((avatarId, name))
+        self.presets.clear()
+        self.presets.update(fresh)
+        self.preset_nums = sum(len(presets) for presets in self.presets.values())
+        return True
     
+    @profiled("save_avatar_state")
     def save_avatar_state(self, presetName: str):
-        avatarId = self.vrcclient.get_avatar_id()
-        avatarState = self.vrcclient.get_avatar_params()
-        preset = AvatarPreset(presetName, avatarId, avatarState)
-        self.presets.setdefault(avatarId, {})[presetName] = preset
-        path = self.dataPath / "presets" / avatarId
-        path.mkdir(parents=True, exist_ok=True)
-        presetPath = path / f"{presetName}.json"
-        presetPath.write_text(json.dumps(preset.to_dict(), indent=2))
+        with metrics.timer("save.total"):
+            avatarId = self.vrcclient.get_avatar_id()
+            with metrics.timer("save.read_params"):
+                avatarState = self.blacklist.filter(self.vrcclient.get_avatar_params())
+            preset = AvatarPreset(presetName, avatarId, avatarState, self.blacklist.key)
+            self.save_avatar_state_from_preset(preset)
         return preset
     
     def save_avatar_state_from_preset(self, preset: AvatarPreset):
-        self.presets.setdefault(preset.avatarId, {})[preset.name] = preset
-        path = self.dataPath / "presets" / preset.avatarId
-        path.mkdir(parents=True, exist_ok=True)
-        presetPath = path / f"{preset.name}.json"
-        presetPath.write_text(json.dumps(preset.to_dict(), indent=2))
+        """
+        Updates the library right away and queues the write to the store.
+        """
+        self._index_preset(preset)
+        self._queue_write(("preset", preset.avatarId, preset.name), preset, lambda: self.store.put(preset))
+
+    def _index_preset(self, preset: AvatarPreset) -> PresetInfo:
+        info = PresetInfo(preset.avatarId, preset.name, len(preset.parameters), time.time(), 0, preset.filterKey)
+        presets = self.presets.setdefault(preset.avatarId, {})
+        if preset.name not in presets:
+            self.preset_nums += 1
+        presets[preset.name] = info
+        self.presetCache.put((preset.avatarId, preset.name), preset)
+        return info
+
+    def _queue_write(self, key: tuple, preset: AvatarPreset, write):
+        """
+        Keeps the preset readable from memory until write (which returns the stored PresetInfo) succeeded,
+        even if it falls out of the cache. A failed write is retried by the writer, the preset is never dropped.
+        """
+        pendingKey = (preset.avatarId, preset.name)
+        info = self.presets[preset.avatarId][preset.name]
+        with self._pendingLock:
+            self._pending[pendingKey] = preset
+            self._pendingDeletes.discard(pendingKey) # replaces a delete still waiting, if any
+        def job():
+            stored = write()
+            info.size = stored.size
+            info.updatedAt = stored.updatedAt
+            with self._pendingLock:
+                if self._pending.get(pendingKey) is preset:
+                    del self._pending[pendingKey]
+        self.writer.submit(key, job)
+
+    def flush(self, timeout: float | None = 5.0) -> bool:
+        """
+        Waits for queued writes. Returns False if some could not be written in time.
+        """
+        return self.writer.flush(timeout)
 
     def is_in_partial_blacklist(self, paramName: str) -> bool:
-        for fix in self.blacklistPartial:
-            if paramName.startswith(fix) == True:
-                return True
-        return False
+        return paramName.startswith(self.blacklist.partial)
+
+    def set_blacklist(self, individual: list[str], partial: list[str]) -> int:
+        """
+        Replaces the blacklist, stores it in the settings and filters the existing presets again. Returns the number of presets rewritten.
+        """
+        self.settings.blacklistIndividual = list(individual)
+        self.settings.blacklistPartial = list(partial)
+        self.blacklist = Blacklist.from_settings(self.settings)
+        return self.refilter_presets()
+
+    def refilter_presets(self) -> int:
+        """
+        Queues a rewrite of the presets saved with another blacklist (or none), decided from their PresetInfo, so presets
+        already filtered with the current blacklist are never read. The writer reads, filters and stores them, the caller
+        never touches the disk. Presets not rewritten yet are filtered when applied. Returns the number of presets queued.
+        """
+        queued = 0
+        for avatarId, presets in list(self.presets.items()):
+            for name, info in list(presets.items()):
+                if info.filterKey == self.blacklist.key:
+                    continue
+                self.writer.submit(("refilter", avatarId, name), lambda a=avatarId, n=name, i=info: self._refilter_stored(a, n, i))
+                queued += 1
+        return queued
+
+    def _refilter_stored(self, avatarId: str, name: str, info: PresetInfo):
+        # runs on the writer, after the writes queued before it
+        preset = self.store.get(avatarId, name)
+        if preset is None: # deleted or renamed in the meantime
+            return
+        key = self.blacklist.key
+        if preset.filterKey != key:
+            preset.parameters = self.blacklist.filter(preset.parameters)
+            preset.filterKey = key
+            stored = self.store.put(preset)
+            info.size = stored.size
+            info.updatedAt = stored.updatedAt
+            info.paramCount = stored.paramCount
+        info.filterKey = key
     
     def find_avatar_preset(self, avatarId: str, presetName: str) -> AvatarPreset: #Ideally here, we throw an error if not found and we handle that properly.
+        """
+        Returns the full preset, its parameters are read from the store the first time and kept in a small LRU cache.
+        """
+        self.get_preset_info(avatarId, presetName)
+        key = (avatarId, presetName)
+        preset = self.presetCache.get(key)
+        if preset is None:
+            with self._pendingLock:
+                preset = self._pending.get(key)
+        if preset is None:
+            preset = self.store.get(avatarId, presetName)
+            if preset is None:
+                raise Exception()
+            self.presetCache.put(key, preset)
+        return preset
+
+    def get_preset_info(self, avatarId: str, presetName: str) -> PresetInfo:
         if avatarId in self.presets:
             if presetName in self.presets[avatarId]:
                 return self.presets[avatarId][presetName]
         raise Exception()
     
-    def delete_preset_deprecated(self, presetName: str) -> bool:
-        preset = self.find_avatar_preset(presetName)
+    def delete_preset(self, preset: AvatarPreset | PresetInfo) -> bool:
         if not preset.name: 
             raise Exception()
-        path = self.dataPath / "presets" / preset.avatarId / f"{preset.name}.json"
-        if not path.is_file():
-            raise Exception()
-        path.unlink()
-        del self.presets[preset.avatarId][presetName]
+        avatarId, name = preset.avatarId, preset.name
+        self.get_preset_info(avatarId, name)
+        self._forget_preset(avatarId, name)
+        with self._pendingLock:
+            self._pendingDeletes.add((avatarId, name))
+        def job():
+            self.store.delete(avatarId, name)
+            self._deleted(avatarId, name)
+        self.writer.submit(("preset", avatarId, name), job)
         return True
 
-    def delete_preset(self, preset: AvatarPreset) -> bool:
-        if not preset.name: 
-            raise Exception()
-        path = self.dataPath / "presets" / preset.avatarId / f"{preset.name}.json"
-        if not path.is_file():
-            raise Exception()
-        path.unlink()
-        del self.presets[preset.avatarId][preset.name]
-        return True
-    
-    def apply_avatar_state(self, presetName: str):
-        currentAvatarId = self.vrcclient.get_avatar_id()
-        preset = self.find_avatar_preset(presetName)
-        if currentAvatarId != preset.avatarId:
-            self.vrcclient.change_avatar(preset.avatarId)
-            self.vrcclient.wait_for_avatar_ready(min_params=1) #this is absolutely necessary because the game often sends back avatar id very early
-        self.vrcclient.get_root_node() # refresh avi data
-        for param in preset.parameters:
-            if param.name not in self.blacklistIndividual and not self.is_in_partial_blacklist(param.rawName):
-                self.vrcclient.send_param_change(param.path, param.value)
-        pass
+    def _deleted(self, avatarId: str, presetName: str):
+        with self._pendingLock:
+            self._pendingDeletes.discard((avatarId, presetName))
 
+    def _forget_preset(self, avatarId: str, presetName: str):
+        self.presetCache.pop((avatarId, presetName))
+        with self._pendingLock:
+            self._pending.pop((avatarId, presetName), None)
+        presets = self.presets.get(avatarId, {})
+        if presets.pop(presetName, None) is not None:
+            self.preset_nums -= 1
+        if not presets:
+            self.presets.pop(avatarId, None)
+    
+    @profiled("apply_avatar_state_by_preset")
     def apply_avatar_state_by_preset(self, preset: AvatarPreset):
-        currentAvatarId = self.vrcclient.get_avatar_id()
-        if currentAvatarId != preset.avatarId:
-            self.vrcclient.change_avatar(preset.avatarId)
-            self.vrcclient.wait_for_avatar_ready(min_params=1) #this is absolutely necessary because the game often sends back avatar id very early
-        self.vrcclient.get_root_node() # refresh avi data
+        with metrics.timer("apply.total"):
+            with self._switchLock:
+                with metrics.timer("apply.get_avatar_id"):
+                    currentAvatarId = self.vrcclient.get_avatar_id()
+                if currentAvatarId != preset.avatarId or self.vrcclient.pendingAvatarId is not None: # an unconfirmed switch may still land
+                    metrics.inc("apply.switches")
+                    with metrics.timer("apply.switch"):
+                        self.vrcclient.change_avatar(preset.avatarId)
+                        self.vrcclient.wait_for_avatar_ready(min_params=1, avatar_id=preset.avatarId) #this is absolutely necessary because the game often sends back avatar id very early
+            return self.send_preset_parameters(preset)
+    
+    def send_preset_parameters(self, preset: AvatarPreset) -> ApplyResult:
+        """
+        Sends the non blacklisted parameters of the preset whose live value differs, in batched OSC bundles.
+        Live values come from the client mirror, resynced from the game first, parameters the avatar doesn't expose are always sent.
+        """
+        with metrics.timer("apply.read_live"):
+            live = self.vrcclient.get_live_values(resync=True) # never trust the mirror to skip a parameter
+        result, changes = self._plan_apply(preset, live)
+        if changes:
+            with metrics.timer("apply.send"):
+                result.bundles = self.vrcclient.send_param_changes(changes)
+        self._record_apply(result)
+        return result
+
+    def _record_apply(self, result: ApplyResult):
+        metrics.inc("apply.count")
+        metrics.inc("apply.params_sent", len(result.sent))
+        metrics.inc("apply.params_skipped", len(result.skipped))
+        metrics.inc("apply.params_blacklisted", len(result.blacklisted))
+        metrics.inc("apply.bundles", result.bundles)
+        log.info("apply", "%r", result)
+
+    def _plan_apply(self, preset: AvatarPreset, live: dict) -> tuple[ApplyResult, list]:
+        """
+        Splits the preset into what must be sent, what is already set and what is blacklisted. Returns (result, [(path, value)]).
+        """
+        result = ApplyResult(preset.name, preset.avatarId)
+        changes = []
+        filtered = preset.filterKey == self.blacklist.key # saved with this blacklist, nothing to filter
         for param in preset.parameters:
-            if param.name not in self.blacklistIndividual and not self.is_in_partial_blacklist(param.rawName):
-                self.vrcclient.send_param_change(param.path, param.value)
-        pass
+            if not filtered and self.blacklist.matches(param.name, param.rawName):
+                result.blacklisted.append(param.rawName)
+            elif param.path in live and values_equal(live[param.path], param.value):
+                result.skipped.append(param.rawName)
+            else:
+                changes.append((param.path, param.value))
+                result.sent.append(param.rawName)
+        return result, changes
     
+    @profiled("rename_preset")
     def rename_preset(self, avatarId: str, presetName: str, newPresetName: str):
-        preset = copy.deepcopy(self.find_avatar_preset(avatarId, presetName))
-        self.delete_preset(preset)
-        preset.name=newPresetName
-        self.save_avatar_state_from_preset(preset)
+        preset = self.find_avatar_preset(avatarId, presetName)
+        if newPresetName == presetName:
+            return preset
+        if newPresetName in self.presets.get(avatarId, {}):
+            raise FileExistsError(f"A preset named {newPresetName} already exists")
+        renamed = AvatarPreset(newPresetName, avatarId, preset.parameters, preset.filterKey)
+        self._forget_preset(avatarId, presetName)
+        self._index_preset(renamed)
+        # the store deletes the old name in the same transaction, a write still waiting for it is not needed anymore
+        self.writer.discard(("preset", avatarId, presetName))
+        with self._pendingLock:
+            self._pendingDeletes.add((avatarId, presetName))
+        def move():
+            stored = self.store.move(renamed, presetName)
+            self._deleted(avatarId, presetName)
+            return stored
+        self._queue_write(("rename", avatarId, presetName, newPresetName), renamed, move)
+        return renamed
 
     def save_settings(self):
         path = self.dataPath / "settings.json"
-        settings = self.settings.to_dict()
-        print(settings)
-        path.write_text(json.dumps(self.settings.to_dict(), indent=2))
+        text = json.dumps(self.settings.to_dict(), indent=2)
+        self.writer.submit("settings", lambda: atomic_write_text(path, text))
     
     def load_settings(self) -> Settings | None:
         path = self.dataPath / "settings.json"
@@ -1,16 +1,37 @@
+import sys
+
+PARAMETERS_PREFIX = "/avatar/parameters/"
+PREFIX_LENGTH = len(PARAMETERS_PREFIX)
+
 class AvatarParameter():
-    def __init__(self, name: str, path: str, value):
-        self.name = name
-        self.path = path
-        self.rawName = path.removeprefix("/avatar/parameters/") #no need to save this
+    # Slotted and interned: a library holds hundreds of thousands of these, mostly with the same few names.
+    __slots__ = ("name", "rawName", "value", "meta", "_prefix", "_path")
+    def __init__(self, name: str, path: str, value, rawName: str | None = None, meta: dict | None = None):
+        self.name = sys.intern(name)
+        if rawName is None:
+            rawName = path.removeprefix(PARAMETERS_PREFIX)
+        self.rawName = sys.intern(rawName) #no need to save this
+        self.meta = meta # TYPE/RANGE/TAGS/DEFAULT from OSCQuery, only kept when asked for. Not saved either
+        if len(path) - len(rawName) == PREFIX_LENGTH and path.startswith(PARAMETERS_PREFIX):
+            self._prefix = PARAMETERS_PREFIX
+            self._path = None
+        elif rawName and path.endswith(rawName):
+            self._prefix = sys.intern(path[:len(path) - len(rawName)]) # path is rebuilt from a shared prefix
+            self._path = None
+        else:
+            self._prefix = ""
+            self._path = path
         if type(value) is list:
             self.value = value[0] #since its passed as an array from osc
         else:
             self.value = value
         pass
+    @property
+    def path(self) -> str:
+        return self._prefix + self.rawName if self._path is None else self._path
     def __repr__(self):
         return f"AvatarParameter(name={self.name!r}, rawName={self.rawName!r} value={self.value}, path={self.path})"
     def to_dict(self):
         return {"name": self.name, "path": self.path, "value": self.value}
     def from_dict(d: dict) -> "AvatarParameter":
-        return AvatarParameter(name=d["name"], value=d["value"], path=d["path"])
\ No newline at end of file
+        return AvatarParameter(name=d["name"], value=d["value"], path=d["path"])
@@ -1,10 +1,12 @@
 from FitCheck.avatarParameter import AvatarParameter
 
 class AvatarPreset():
-    def __init__(self, name, avatarId, parameters):
+    __slots__ = ("name", "avatarId", "uniqueKey", "filterKey", "parameters")
+    def __init__(self, name, avatarId, parameters, filterKey=""):
         self.name = name
         self.avatarId = avatarId
         self.uniqueKey = ""
+        self.filterKey = filterKey # key of the blacklist the parameters were filtered with, "" if never filtered
         self.parameters: list[AvatarParameter] = parameters
         pass
     def to_dict(self):
@@ -12,6 +14,7 @@ class AvatarPreset():
             "name": self.name,
             "avatarId": self.avatarId,
             "uniqueKey": self.uniqueKey,
+            "filterKey": self.filterKey,
             "parameters": [p.to_dict() for p in self.parameters],
         }
     def from_dict(d: dict) -> "AvatarPreset":
@@ -20,4 +23,5 @@ class AvatarPreset():
             name=d["name"],
             avatarId=d["avatarId"],
             parameters=params,
+            filterKey=d.get("filterKey", ""),
         )
\ No newline at end of file
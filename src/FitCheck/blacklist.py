@@ -0,0 +1,25 @@
+import hashlib
+import json
+
+class Blacklist():
+    def __init__(self, individual: list[str], partial: list[str]):
+        """
+        Compiled parameter blacklist. Individual entries match the parameter name, partial entries are prefixes of the raw name.
+        """
+        self.individual = frozenset(individual)
+        self.partial = tuple(sorted(set(partial)))
+        # identifies this exact blacklist, presets remember the one they were filtered with
+        self.key = hashlib.sha1(json.dumps([sorted(self.individual), self.partial]).encode()).hexdigest()[:16]
+        pass
+    def from_settings(settings) -> "Blacklist":
+        return Blacklist(settings.blacklistIndividual, settings.blacklistPartial)
+    def matches(self, name: str, rawName: str) -> bool:
+        # str.startswith with a tuple checks every prefix in one call
+        return name in self.individual or rawName.startswith(self.partial)
+    def filter(self, params: list) -> list:
+        """
+        Returns the parameters that are not blacklisted.
+        """
+        individual = self.individual
+        partial = self.partial
+        return [p for p in params if p.name not in individual and not p.rawName.startswith(partial)]
@@ -1,34 +1,66 @@
 # flet_preset_manager.py
 from __future__ import annotations
-from typing import List, Tuple
+import asyncio
+from concurrent.futures import Future
+import bisect
+import time
+from typing import Dict, List
 import flet as ft
-from FitCheck.avatarManager import AvatarManager
+from FitCheck.asyncAvatarManager import AsyncAvatarManager
 import os
 from FitCheck.avatarPreset import AvatarPreset
+from FitCheck.logger import log
+from FitCheck.metrics import metrics
+from FitCheck.profiling import profiler
+
+TILE_BATCH = 40 # avatar tiles added at a time, more are added when scrolling near the end
+ROW_HEIGHT = 48
+ROWS_VISIBLE = 8 # preset rows shown before the list of an avatar scrolls
 
 class FletPresetManagerUI:
     """Flet-based UI for managing avatar presets."""
 
-    def __init__(self, manager: AvatarManager) -> None:
+    def __init__(self, manager: AsyncAvatarManager) -> None:
         self.manager = manager
 
-        self._preset_items: List[Tuple[str, List[str]]] = []  # list of (avatar_id, [presets])
+        self._preset_items: Dict[str, List[str]] = {}  # avatar_id -> sorted preset names, what the tiles show
+        self._avatar_order: List[str] = [] # sorted avatar ids
+        self._tiles: Dict[str, ft.Container] = {} # tiles built so far, for the first self._shown avatars of _avatar_order
+        self._shown = 0
+        self._list_view: ft.ListView | None = None
         self.page: ft.Page | None = None
         self.vrchat_online: bool = False
         self.status_chip: ft.Container | None = None
         self.drawer: ft.Control | None = None
         self.vrchat_online: bool = False
+        self._task: Future | None = None # operation running on the page loop, one at a time
+        self._task_label = ""
+        self._task_supersedes = False
 
     def _load_presets(self):
         try:
-            self.manager.parse_existing_presets()
-            self._preset_items = [
-                (avatar_id, sorted(list(presets.keys())))
-                for avatar_id, presets in sorted(self.manager.presets.items())
-            ]
+            self.manager.refresh_presets()
         except Exception as exc:
             self._notify(f'Failed to load presets: {exc}', 4000, "error")
-            self._preset_items = []
+
+    def _sync_preset_items(self, avatar_ids=None) -> List[str]:
+        """
+        Updates _preset_items from the manager, for avatar_ids or every avatar. Returns the avatars whose presets changed.
+        The manager keeps presets up to date on every change, no need to go back to the store.
+        """
+        if avatar_ids is None:
+            avatar_ids = set(self._preset_items) | set(self.manager.presets)
+        changed = []
+        for avatar_id in avatar_ids:
+            presets = self.manager.presets.get(avatar_id)
+            names = sorted(presets) if presets else None
+            if names != self._preset_items.get(avatar_id):
+                if names:
+                    self._preset_items[avatar_id] = names
+                else:
+                    self._preset_items.pop(avatar_id, None)
+                changed.append(avatar_id)
+        return changed
     
     def _open_preset_location(self):
         os.startfile(str(self.manager.dataPath))
@@ -73,8 +105,49 @@ class FletPresetManagerUI:
         pass
 
     def _open_presets(self):
+        self._render_main(self.page)
+
+    def _toggle_profiling(self):
+        # hidden on purpose, a long press on the title, for bug reports
+        profiler.enabled = not profiler.enabled
+        if profiler.enabled:
+            self._notify(f'Profiling on, reports go to {self.manager.dataPath / "profiles"}', 4000, "warning")
+        else:
+            self._notify(f'Profiling off, {len(profiler.reports)} reports written', 3000, "success")
+
+    def _open_metrics(self):
         self.page.controls.clear()
-        self._refresh(self.page)
+        lines = ft.ListView(spacing=2, expand=True)
+        def show(e=None):
+            lines.controls = [ft.Text(line, selectable=True, font_family="monospace", size=12) for line in metrics.summary()] \
+                or [ft.Text("Nothing recorded yet")]
+            self.page.update()
+        def save(e):
+            stamp = time.strftime("%Y%m%d-%H%M%S")
+            try:
+                path = metrics.dump(self.manager.dataPath / f"metrics-{stamp}.json")
+                self._notify(f'Metrics saved to {path}', 3000, "success")
+            except OSError as exc:
+                self._notify(f'Could not save the metrics: {exc}', 3000, "error")
+        def reset(e):
+            metrics.reset()
+            show()
+        self.page.add(ft.Container(
+            content=ft.Column(controls=[
+                ft.Row(controls=[
+                    ft.Text("Metrics", theme_style=ft.TextThemeStyle.TITLE_LARGE, expand=True),
+                    ft.TextButton("Refresh", on_click=show),
+                    ft.TextButton("Save as JSON", on_click=save),
+                    ft.TextButton("Reset", on_click=reset),
+                ]),
+                ft.Text("Latencies are in milliseconds, percentiles are bucket upper bounds.", size=12),
+                ft.Divider(),
+                lines,
+            ], expand=True),
+            padding=ft.padding.all(16),
+            expand=True,
+        ))
+        show()
 
     def _handle_sidebar(self, e: ft.ControlEvent):
         selected_index = e.control.selected_index
@@ -82,7 +155,8 @@ class FletPresetManagerUI:
             0: self._open_presets,
            # 1: self._open_settings,      
             1: self._open_preset_location,
-            2: self._open_about,
+            2: self._open_metrics,
+            3: self._open_about,
         }
         handler = actions.get(selected_index)
         self.page.close(self.drawer)
@@ -91,7 +165,7 @@ class FletPresetManagerUI:
     
     def _handle_avatar_rename(self, avatar_name: str, avatar_id: str):
         self.manager.settings.associate_name_to_avatar(avatar_name, avatar_id)
-        self._refresh(self.page)
+        self._update_avatar_title(avatar_id)
 
     def _show_avatar_menu(self, avatar_id, e: ft.TapEvent):
         current_name = self.manager.settings.get_name_for_avatar(avatar_id)
@@ -132,6 +206,8 @@ class FletPresetManagerUI:
                 ft.Divider(),
                 ft.NavigationDrawerDestination(icon=ft.Icons.FOLDER, label="Open presets location"),
                 ft.Divider(),
+                ft.NavigationDrawerDestination(icon=ft.Icons.QUERY_STATS, label="Metrics"),
+                ft.Divider(),
                 ft.NavigationDrawerDestination(icon=ft.Icons.INFO, label="About"),
             ],
             selected_index=0,
@@ -158,7 +234,7 @@ class FletPresetManagerUI:
             title=ft.Container(
                 content=ft.Row(
                     [
-                        ft.Text("FitCheck"), 
+                        ft.GestureDetector(content=ft.Text("FitCheck"), on_long_press_end=lambda e: self._toggle_profiling()), 
                         self.status_chip,
                     ], 
                     spacing=16
@@ -171,7 +247,7 @@ class FletPresetManagerUI:
         )
 
         self._load_presets()
-        self._render_main(page)
+        self._rerender(page)
 
     def set_vrchat_online(self, is_online: bool, ip: str | None = None, port: int | None = None):
         self.vrchat_online = is_online
@@ -188,51 +264,73 @@ class FletPresetManagerUI:
             self.status_chip.content.controls[1].value = "VRChat: Offline"
         self.page.update()
 
-    def _avatar_tile(self, avatar_id: str, presets: list[str]) -> ft.ExpansionTile:
+    def _avatar_title(self, avatar_id: str) -> str:
         avatar_name = self.manager.settings.get_name_for_avatar(avatar_id)
+        return avatar_name if avatar_name != "" else avatar_id
+
+    def _avatar_tile(self, avatar_id: str) -> ft.Container:
+        """
+        Collapsed tile of an avatar, its preset rows are only built when it's expanded.
+        """
+        rows = ft.ListView(spacing=0, item_extent=ROW_HEIGHT, height=0)
+        expansion = ft.ExpansionTile(
+            title=ft.Text(self._avatar_title(avatar_id)),
+            shape=ft.RoundedRectangleBorder(radius=5),
+            collapsed_shape=ft.RoundedRectangleBorder(radius=5),
+            maintain_state=True,
+            on_change=lambda e, i=avatar_id: self._on_tile_change(i, e),
+            controls=[
+                ft.Container(
+                    padding=ft.padding.all(12),
+                    border=ft.border.only(top=ft.BorderSide(1.5, ft.Colors.with_opacity(0.08, ft.Colors.ON_SURFACE))),
+                    bgcolor=ft.Colors.with_opacity(0.03, ft.Colors.ON_SURFACE),
+                    content=rows,
+                )
+            ],
+        )
         return ft.Container(
+            key=avatar_id,
+            data={"expansion": expansion, "rows": rows, "built": {}}, # built: preset name -> row, once expanded
             border=ft.border.all(1.5, ft.Colors.with_opacity(0.08, ft.Colors.ON_SURFACE)),
             border_radius=8,
             content=ft.GestureDetector(
-                    content=ft.ExpansionTile(
-                    title=ft.Text(avatar_name if avatar_name != "" else avatar_id),
-                    shape=ft.RoundedRectangleBorder(radius=5),
-                    collapsed_shape=ft.RoundedRectangleBorder(radius=5),               
-                    controls=[
-                        ft.Container(
-                            padding=ft.padding.all(12),
-                            border=ft.border.only(top=ft.BorderSide(1.5, ft.Colors.with_opacity(0.08, ft.Colors.ON_SURFACE))),
-                            bgcolor=ft.Colors.with_opacity(0.03, ft.Colors.ON_SURFACE),
-                            content=ft.Column(
-                                [
-                                    ft.Column(
-                                        [
-                                            ft.Row(
-                                                [
-                                                    ft.Text(p, expand=True),
-                                                    ft.TextButton("Apply", on_click=lambda e, n=p, i=avatar_id: self._apply_preset(i, n)),
-                                                    ft.TextButton("Rename", on_click=lambda e, n=p, i=avatar_id: self._rename_preset(i, n)),
-                                                    ft.TextButton(
-                                                        "Delete",
-                                                        style=ft.ButtonStyle(color=ft.Colors.RED_400),
-                                                        on_click=lambda e, n=p, i=avatar_id: self._delete_preset(i, n),
-                                                    ),
-                                                ],
-                                            )
-                                            for p in presets
-                                        ],
-                                        spacing=4,
-                                    ),
-                                ],
-                                spacing=10,
-                            ),
-                        )
-                    ],
-                ),
+                content=expansion,
                 on_long_press_end=lambda e: self._show_avatar_menu(avatar_id=avatar_id, e=e)
             ) 
         )
-    
+
+    def _preset_row(self, avatar_id: str, p: str) -> ft.Row:
+        return ft.Row(
+            [
+                ft.Text(p, expand=True),
+                ft.TextButton("Apply", on_click=lambda e, n=p, i=avatar_id: self._apply_preset(i, n)),
+                ft.TextButton("Rename", on_click=lambda e, n=p, i=avatar_id: self._rename_preset(i, n)),
+                ft.TextButton(
+                    "Delete",
+                    style=ft.ButtonStyle(color=ft.Colors.RED_400),
+                    on_click=lambda e, n=p, i=avatar_id: self._delete_preset(i, n),
+                ),
+            ],
+            key=p,
+        )
+
+    def _on_tile_change(self, avatar_id: str, e: ft.ControlEvent):
+        tile = self._tiles.get(avatar_id)
+        if tile and e.data == "true" and not tile.data["built"]:
+            self._fill_rows(avatar_id, tile)
+            tile.update()
+
+    def _fill_rows(self, avatar_id: str, tile: ft.Container):
+        """
+        (Re)builds the preset rows of an expanded tile, reusing the rows of presets it already shows.
+        """
+        built = tile.data["built"]
+        names = self._preset_items.get(avatar_id, [])
+        rows = {name: built.get(name) or self._preset_row(avatar_id, name) for name in names}
+        tile.data["built"] = rows
+        tile.data["rows"].controls = list(rows.values())
+        tile.data["rows"].height = min(len(rows), ROWS_VISIBLE) * ROW_HEIGHT
+
     # ----- Actions -----
     def _notify(self, msg: str, duration: int, level: str = "info"):
         if not self.page:
@@ -245,28 +343,68 @@ class FletPresetManagerUI:
         }.get(level, ft.Colors.BLUE_300)
         self.page.open(ft.SnackBar(ft.Text(msg), bgcolor=color, duration=duration))
 
+    def _start_task(self, label: str, handler, *args, supersedes: bool = False):
+        """
+        Runs an async operation on the page loop so the window keeps responding. One at a time, it can be cancelled from its snack bar.
+        With supersedes, it may start while another superseding one runs, the manager makes the newest win (applies).
+        """
+        if self._task and not self._task.done() and not (supersedes and self._task_supersedes):
+            self._notify(f'{self._task_label} is still running', 2000, "warning")
+            return
+        self._task_label = label
+        self._task_supersedes = supersedes
+        self._task = self.page.run_task(handler, *args)
+
+    def _cancel_task(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+
+    def _show_progress(self, msg: str):
+        """
+        Opens a snack bar with a Cancel action for the running operation. Returns a callback updating its text.
+        """
+        text = ft.Text(msg)
+        self.page.open(ft.SnackBar(text, action="Cancel", on_action=lambda e: self._cancel_task(), duration=120000))
+        def progress(step: str):
+            text.value = f'{msg} - {step}'
+            self.page.update()
+        return progress
+
     def _apply_preset(self, avatar_id: str, name: str):
+        self._start_task(f'Applying preset {name}', self._apply_preset_async, avatar_id, name, supersedes=True)
+
+    async def _apply_preset_async(self, avatar_id: str, name: str):
         try:
             preset: AvatarPreset = self.manager.find_avatar_preset(avatar_id, name)
-            self._notify(f'Applying preset {name} to avatar with id {preset.avatarId}', duration=2000)
-            self.manager.apply_avatar_state_by_preset(preset)
-            #self.manager.apply_avatar_state(name)
-            #something here to wait a full two second
-            self._notify(f'Preset {name} has been applied !',duration=2000, level="success")
+            progress = self._show_progress(f'Applying preset {name} to avatar with id {preset.avatarId}')
+            result = await self.manager.apply_latest_async(preset, progress)
+            if result is None:
+                return # another preset was clicked since, its own snack bar is already up
+            self._notify(f'Preset {name} has been applied ! ({len(result.sent)} changed, {len(result.skipped)} already set)',duration=2000, level="success")
+        except asyncio.CancelledError:
+            self._notify(f'Applying preset {name} was cancelled', 2000, "warning")
+            raise
         except Exception as exc:
             self._notify(f'Failed to apply preset {name}: {exc}', 2000, "error")
     
-    def _create_preset(self, name: str):
+    async def _create_preset_async(self, name: str):
         try:
-            return self.manager.save_avatar_state(name)
+            progress = self._show_progress(f'Creating preset {name}')
+            preset = await self.manager.save_avatar_state_async(name, progress)
+            self._rerender(self.page, preset.avatarId)
+            self._notify(f'Preset {name} has been created !', 2000, "success")
+            return preset
+        except asyncio.CancelledError:
+            self._notify(f'Creating preset {name} was cancelled', 2000, "warning")
+            raise
         except Exception as exc:
             self._notify(f'Failed to create preset {name}: {exc}', 2000, "error")
 
     def _delete_preset(self, avatar_id: str, name: str):
         try:
-            preset = self.manager.find_avatar_preset(avatar_id, name)
+            preset = self.manager.get_preset_info(avatar_id, name)
             self.manager.delete_preset(preset)
-            self._refresh(self.page)
+            self._rerender(self.page, avatar_id)
         except Exception as exc:
             self._notify(f'Failed to delete preset {name}: {exc}', 2000, "error")
 
@@ -279,9 +417,13 @@ class FletPresetManagerUI:
             def on_save(ev: ft.ControlEvent):
                 val = nameInput.value
                 if val and val != "":
-                    self.manager.rename_preset(avatar_id, name, val)
+                    try:
+                        self.manager.rename_preset(avatar_id, name, val)
+                    except FileExistsError:
+                        self._notify(f'A preset named {val} already exists', 2000, "error")
+                        return
                 self.page.close(ctx_menu)
-                self._refresh(self.page)
+                self._rerender(self.page, avatar_id)
 
             ctx_menu = ft.AlertDialog(
             title="Rename preset",
@@ -303,7 +445,14 @@ class FletPresetManagerUI:
             self._notify(f'Failed to rename preset {name}: {exc}', 2000, "error")
 
     def _handle_new_avatar(self):
-        avatar_id = self.manager.vrcclient.get_avatar_id()
+        self._start_task("Creating a preset", self._handle_new_avatar_async)
+
+    async def _handle_new_avatar_async(self):
+        try:
+            avatar_id = await self.manager.get_avatar_id_async()
+        except Exception as exc:
+            self._notify(f'Could not read the current avatar: {exc}', 2000, "error")
+            return
         nameInput = ft.TextField(
             label="Associate a name",
             max_length=30
@@ -344,11 +493,10 @@ class FletPresetManagerUI:
         tf = ft.TextField(label="Preset name", autofocus=True)
         def on_ok(ev):
             val = (tf.value or "").strip()
-            if val:
-                self._create_preset(val)
             dlg.open = False
             self.page.update()
-            self._refresh(self.page)
+            if val:
+                self._start_task(f'Creating preset {val}', self._create_preset_async, val)
 
         dlg = ft.AlertDialog(
             modal=True,
@@ -365,17 +513,86 @@ class FletPresetManagerUI:
     def _on_program_close(self, e: ft.AppLifecycleStateChangeEvent):
         if e.state == ft.AppLifecycleState.HIDE or e.state == ft.AppLifecycleState.DETACH:
             self.manager.save_settings()
+            if not self.manager.flush():
+                log.error("writer", "could not write everything before closing: %s", self.manager.writer.lastError)
+            log.flush()
 
     def _render_main(self, page: ft.Page):
-        tiles = [self._avatar_tile(aid, presets) for aid, presets in self._preset_items]
-        list_view = ft.ListView(controls=tiles, spacing=6, padding=10, auto_scroll=False)
+        """
+        Puts the preset list on the page. Tiles are only built on the first call, later ones bring the list up to date.
+        """
+        if self._list_view is None:
+            self._sync_preset_items()
+            self._avatar_order = sorted(self._preset_items)
+            self._tiles = {}
+            self._shown = 0
+            self._list_view = ft.ListView(spacing=6, padding=10, auto_scroll=False, expand=True, on_scroll_interval=100,
+                                          on_scroll=self._on_list_scroll)
+            self._show_more_tiles()
         page.controls.clear()
-        page.add(list_view)
-        page.update()
+        page.add(self._list_view)
+        self._patch_tiles()
+
+    def _show_more_tiles(self) -> bool:
+        end = min(self._shown + TILE_BATCH, len(self._avatar_order))
+        if end == self._shown:
+            return False
+        for avatar_id in self._avatar_order[self._shown:end]:
+            self._tiles[avatar_id] = self._avatar_tile(avatar_id)
+            self._list_view.controls.append(self._tiles[avatar_id])
+        self._shown = end
+        return True
+
+    def _on_list_scroll(self, e: ft.OnScrollEvent):
+        if e.max_scroll_extent - e.pixels < 600 and self._show_more_tiles():
+            self._list_view.update()
+
+    def _patch_tiles(self, avatar_ids=None):
+        """
+        Brings the tiles of avatar_ids (every avatar by default) in line with the manager, touching only the ones that changed.
+        """
+        changed = self._sync_preset_items(avatar_ids)
+        for avatar_id in changed:
+            names = self._preset_items.get(avatar_id)
+            tile = self._tiles.get(avatar_id)
+            if names is None:
+                if avatar_id in self._avatar_order:
+                    self._avatar_order.remove(avatar_id)
+                if tile is not None:
+                    del self._tiles[avatar_id]
+                    self._list_view.controls.remove(tile)
+                    self._shown -= 1
+            elif avatar_id not in self._avatar_order:
+                index = bisect.bisect(self._avatar_order, avatar_id)
+                self._avatar_order.insert(index, avatar_id)
+                if index <= self._shown: # the built tiles stay the first _shown avatars, later ones come from _show_more_tiles
+                    tile = self._avatar_tile(avatar_id)
+                    self._tiles[avatar_id] = tile
+                    self._list_view.controls.insert(index, tile)
+                    self._shown += 1
+            elif tile is not None and tile.data["built"]:
+                self._fill_rows(avatar_id, tile)
+        if self.page:
+            self.page.update()
+
+    def _update_avatar_title(self, avatar_id: str):
+        tile = self._tiles.get(avatar_id)
+        if tile is not None:
+            tile.data["expansion"].title.value = self._avatar_title(avatar_id)
+            self.page.update()
 
     def _refresh(self, page: ft.Page):
         self._load_presets()
-        self._render_main(page)
+        self._rerender(page)
+
+    def _rerender(self, page: ft.Page, avatar_id: str | None = None):
+        """
+        Shows the changes made through the manager, only the tile of avatar_id when it's the only one affected.
+        """
+        if self._list_view is None or self._list_view not in page.controls:
+            self._render_main(page)
+        else:
+            self._patch_tiles(None if avatar_id is None else [avatar_id])
 
 # -------- entrypoint --------
     def run(self, page: ft.Page):
@@ -1,10 +1,159 @@
+import atexit
+import os
+import sys
+import threading
 import time
-import pathlib
+from collections import deque
+from pathlib import Path
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
 
 class Logger():
-    def __init__(self):
-        self.buffer = list[str]
+    def __init__(self, path: Path | None = None, level: int = INFO, echoLevel: int = WARNING, capacity: int = 2000,
+                 flushInterval: float = 1.0, maxBytes: int = 1024 * 1024, backups: int = 3):
+        """
+        Keeps the last capacity records in memory and appends them to a rotating log file from a background thread,
+        the caller never formats nor writes anything. path defaults to logs/fitcheck.log in FLET_APP_STORAGE_DATA,
+        looked up when flushing. Records at echoLevel or above are also written to stderr.
+        Messages are formatted %-style with their args on the flush thread, so args must not change after logging.
+        """
+        self.path = path
+        self.level = level
+        self.echoLevel = echoLevel
+        self.flushInterval = flushInterval
+        self.maxBytes = maxBytes
+        self.backups = backups
+        self.buffer: deque = deque(maxlen=capacity) # (serial, time, level, tag, message, args)
+        self.dropped = 0 # records that left the buffer before being written
+        self._serial = 0 # records logged so far
+        self._written = 0 # serial of the first record not written yet
+        self._cond = threading.Condition()
+        self._flushWanted = False
+        self._closed = False
+        self._thread: threading.Thread | None = None
         pass
 
-    def log(message: str):
-        pass
\ No newline at end of file
+    def log(self, level: int, tag: str, message: str, *args):
+        if level < self.level:
+            return
+        with self._cond:
+            if len(self.buffer) == self.buffer.maxlen and self.buffer[0][0] >= self._written:
+                self.dropped += 1
+            self.buffer.append((self._serial, time.time(), level, tag, message, args))
+            self._serial += 1
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._run, name="fitcheck-logger", daemon=True)
+                self._thread.start()
+            if level >= ERROR:
+                self._flushWanted = True
+                self._cond.notify_all()
+
+    def debug(self, tag: str, message: str, *args):
+        self.log(DEBUG, tag, message, *args)
+
+    def info(self, tag: str, message: str, *args):
+        self.log(INFO, tag, message, *args)
+
+    def warning(self, tag: str, message: str, *args):
+        self.log(WARNING, tag, message, *args)
+
+    def error(self, tag: str, message: str, *args):
+        self.log(ERROR, tag, message, *args)
+
+    def lines(self, count: int | None = None) -> list[str]:
+        """
+        The last count records of the buffer (all of them by default), formatted, oldest first.
+        """
+        with self._cond:
+            records = list(self.buffer)
+        return [format_record(r) for r in records[-count:]] if count else [format_record(r) for r in records]
+
+    def flush(self, timeout: float | None = 2.0) -> bool:
+        """
+        Waits until everything logged so far was written. Returns False on timeout, or if there is nowhere to write to.
+        """
+        with self._cond:
+            if self._thread is None:
+                return self._written == self._serial
+            target = self._serial
+            self._flushWanted = True
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: self._written >= target or self._closed, timeout) and self._written >= target
+
+    def close(self, timeout: float | None = 2.0):
+        self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _log_path(self) -> Path | None:
+        if self.path is not None:
+            return self.path
+        dataDir = os.getenv("FLET_APP_STORAGE_DATA")
+        return Path(dataDir) / "logs" / "fitcheck.log" if dataDir else None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._flushWanted or self._closed, self.flushInterval)
+                self._flushWanted = False
+                closed = self._closed
+                records = [r for r in self.buffer if r[0] >= self._written]
+            if records:
+                self._write(records)
+            with self._cond:
+                self._cond.notify_all()
+            if closed:
+                return
+
+    def _write(self, records: list):
+        lines = [format_record(r) for r in records]
+        for record, line in zip(records, lines):
+            if record[2] >= self.echoLevel:
+                print(line, file=sys.stderr)
+        path = self._log_path()
+        if path is None:
+            with self._cond:
+                self._written = records[-1][0] + 1 # no data directory yet, the buffer is all there is
+            return
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            if path.exists() and path.stat().st_size >= self.maxBytes:
+                self._rotate(path)
+            with open(path, "a", encoding="utf-8") as file:
+                file.write("\n".join(lines) + "\n")
+        except OSError as exc:
+            print(f"[logger] could not write {path}: {exc}", file=sys.stderr)
+        with self._cond:
+            self._written = records[-1][0] + 1
+
+    def _rotate(self, path: Path):
+        # fitcheck.log -> fitcheck.log.1 -> ... -> fitcheck.log.<backups>, the oldest one is dropped
+        for n in range(self.backups - 1, 0, -1):
+            older = path.with_name(f"{path.name}.{n}")
+            if older.exists():
+                os.replace(older, path.with_name(f"{path.name}.{n + 1}"))
+        if self.backups > 0:
+            os.replace(path, path.with_name(f"{path.name}.1"))
+        else:
+            path.unlink()
+
+def format_record(record) -> str:
+    _, at, level, tag, message, args = record
+    if args:
+        try:
+            message = message % args
+        except (TypeError, ValueError) as exc:
+            message = f"{message} {args!r} (bad format: {exc})"
+    stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(at))
+    return f"{stamp}.{int(at * 1000) % 1000:03d} {LEVEL_NAMES.get(level, level)} [{tag}] {message}"
+
+# the logger of the app, FITCHECK_LOG_LEVEL=DEBUG (or INFO, WARNING, ERROR) changes what gets recorded
+log = Logger(level={name: value for value, name in LEVEL_NAMES.items()}.get(os.getenv("FITCHECK_LOG_LEVEL", "").upper(), INFO))
+atexit.register(log.close)
@@ -0,0 +1,28 @@
+from collections import OrderedDict
+
+class LRUCache():
+    def __init__(self, maxsize: int):
+        """
+        Keeps the maxsize most recently used values, the oldest one is dropped when a new one is put.
+        """
+        self.maxsize = maxsize
+        self._items: OrderedDict = OrderedDict()
+        pass
+    def __len__(self):
+        return len(self._items)
+    def __contains__(self, key):
+        return key in self._items
+    def get(self, key, default=None):
+        if key not in self._items:
+            return default
+        self._items.move_to_end(key)
+        return self._items[key]
+    def put(self, key, value):
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+    def pop(self, key, default=None):
+        return self._items.pop(key, default)
+    def clear(self):
+        self._items.clear()
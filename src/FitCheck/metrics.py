@@ -0,0 +1,114 @@
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from FitCheck.writeBehind import atomic_write_text
+
+# upper bounds of the latency buckets, in milliseconds, the last bucket takes everything above
+LATENCY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000)
+
+class Histogram():
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        """
+        Counts observations per bucket, plus count/sum/min/max. Percentiles are read from the buckets,
+        so they are the upper bound of the bucket they fall in.
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min: float | None = None
+        self.max: float | None = None
+        self.last: float | None = None
+        pass
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.last = value
+    def percentile(self, p: float) -> float | None:
+        if not self.count:
+            return None
+        rank = p * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "mean": self.total / self.count if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            "last": self.last,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            "buckets": {str(bound): count for bound, count in zip(self.buckets + ("inf",), self.counts)},
+        }
+
+class Metrics():
+    def __init__(self):
+        """
+        Counters and latency histograms (in milliseconds) of the app, by dotted name ("apply.send", "oscq.bytes_fetched"...).
+        Cheap enough for the hot paths: a lock and a dict lookup per record.
+        """
+        self.counters: dict[str, int] = {}
+        self.histograms: dict[str, Histogram] = {}
+        self.startedAt = time.time()
+        self._lock = threading.Lock()
+        pass
+    def inc(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+    def observe(self, name: str, value: float):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+    @contextmanager
+    def timer(self, name: str):
+        """
+        Records how long the block took, in milliseconds, into the histogram name. Failed blocks count too.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, (time.perf_counter() - start) * 1000)
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.startedAt = time.time()
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "startedAt": self.startedAt,
+                "takenAt": time.time(),
+                "counters": dict(sorted(self.counters.items())),
+                "histograms": {name: h.to_dict() for name, h in sorted(self.histograms.items())},
+            }
+    def dump(self, path: Path) -> Path:
+        atomic_write_text(path, json.dumps(self.snapshot(), indent=2))
+        return path
+    def summary(self) -> list[str]:
+        """
+        One line per metric, for showing in the UI.
+        """
+        snapshot = self.snapshot()
+        lines = [f"{name}: {value}" for name, value in snapshot["counters"].items()]
+        for name, h in snapshot["histograms"].items():
+            lines.append(f"{name}: n={h['count']} mean={h['mean']:.1f}ms p50<={h['p50']:.0f}ms p90<={h['p90']:.0f}ms max={h['max']:.1f}ms")
+        return lines
+
+# the metrics of the app
+metrics = Metrics()
@@ -1,31 +1,75 @@
 import socket
 import threading
+from typing import Callable
 from zeroconf import ServiceBrowser, ServiceStateChange, Zeroconf
+from FitCheck.logger import log
+from FitCheck.metrics import metrics
+
+SERVICE_TYPE = "_oscjson._tcp.local."
 
 class OscQueryDiscovery():
-    def __init__(self):
+    def __init__(self, on_online: Callable[[str, int], None] = None, on_offline: Callable[[], None] = None):
         """
         Initiates a new OscQueryDiscovery.
+        Meant to live as long as the app: it follows the Added/Updated/Removed events of the VRChat OSCQuery service,
+        so a restarted VRChat on a new port is picked up as it announces itself.
+        on_online(ip, port) is called when VRChat appears or moves to another endpoint, on_offline() when it's gone.
+        Callbacks run on the zeroconf thread.
         """
-        self.__zeroconf = Zeroconf()
         self.ip = ""
         self.port: int = 0
         self.name = ""
         self.host = ""
+        self.on_online = on_online
+        self.on_offline = on_offline
+        self.__services = {} # service name -> (ip, port, host), in the order they showed up
+        self.__lock = threading.Lock()
         self.__found = threading.Event()
-        self.__serviceBrowser = ServiceBrowser(self.__zeroconf, "_oscjson._tcp.local.", handlers=[self.scan])
+        self.__zeroconf = Zeroconf()
+        self.__serviceBrowser = ServiceBrowser(self.__zeroconf, SERVICE_TYPE, handlers=[self.scan])
         pass
+
     def scan(self, zeroconf: Zeroconf, service_type, name: str, state_change):
-        if state_change is ServiceStateChange.Added:
+        if not name.lower().startswith("vrchat"):
+            return
+        if state_change is ServiceStateChange.Added or state_change is ServiceStateChange.Updated:
             info = zeroconf.get_service_info(service_type, name)
-            if info and name.lower().startswith("vrchat"):
-                ips = self.inet_addrs(info.addresses)
-                self.ip = ips[0]
-                self.port = info.port
-                self.name = name
-                self.host = info.server
-                self.__found.set()
-        pass
+            ips = self.inet_addrs(info.addresses) if info else []
+            if not ips:
+                return
+            with self.__lock:
+                if state_change is ServiceStateChange.Added:
+                    self.__services.pop(name, None) # a service that comes back is the newest one
+                self.__services[name] = (ips[0], info.port, info.server)
+        elif state_change is ServiceStateChange.Removed:
+            with self.__lock:
+                if self.__services.pop(name, None) is None:
+                    return
+        self._select()
+
+    def _select(self):
+        # the newest service wins, callbacks only fire when the endpoint actually changes
+        with self.__lock:
+            if self.__services:
+                name, (ip, port, host) = next(reversed(self.__services.items()))
+            else:
+                name, ip, port, host = "", "", 0, ""
+            if (ip, port) == (self.ip, self.port):
+                self.name, self.host = name, host
+                return
+            self.ip, self.port, self.name, self.host = ip, port, name, host
+        metrics.inc("discovery.mdns_changes")
+        if port:
+            self.__found.set()
+            log.info("discovery", "VRChat found at %s:%d", ip, port)
+            if self.on_online:
+                self.on_online(ip, port)
+        else:
+            self.__found.clear()
+            log.info("discovery", "VRChat is gone")
+            if self.on_offline:
+                self.on_offline()
+
     def inet_addrs(self, addresses):
         out = []
         for addr in addresses:
@@ -34,7 +78,13 @@ class OscQueryDiscovery():
             except OSError:
                 pass
         return out
+
+    def is_online(self) -> bool:
+        return self.__found.is_set()
+
     def wait(self, timeout):
         return self.__found.wait(timeout=timeout)
+
     def stop(self):
-        self.__zeroconf.close()
\ No newline at end of file
+        self.__serviceBrowser.cancel()
+        self.__zeroconf.close()
@@ -0,0 +1,174 @@
+import json
+import lzma
+import struct
+import zlib
+from array import array
+from FitCheck.avatarParameter import AvatarParameter, PARAMETERS_PREFIX
+from FitCheck.avatarPreset import AvatarPreset
+
+# Compact preset format, version 1:
+#   MAGIC, version (u8), compression (u8), then the (maybe compressed) payload:
+#   counts: parameters, floats, ints (<III)
+#   blocks, each a <I byte length then "\0" joined utf-8 strings:
+#     preset strings (name, avatarId, uniqueKey, filterKey), raw names, names (empty when the last segment of the raw name),
+#     paths (empty when /avatar/parameters/ + raw name), string values
+#   one type byte per parameter, then the float64 and int64 values in parameter order
+# Anything that doesn't fit (a "\0" in a string, an int over 64 bits) is written as json instead.
+MAGIC = b"FCP"
+VERSION = 1
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_LZMA = 2
+
+TYPE_NONE = 0
+TYPE_FALSE = 1
+TYPE_TRUE = 2
+TYPE_INT = 3
+TYPE_FLOAT = 4
+TYPE_STR = 5
+TYPE_REMOVED = 6
+
+class Removed():
+    # value of a parameter a delta removes from its base, see presetDelta
+    def __repr__(self):
+        return "REMOVED"
+
+REMOVED = Removed()
+
+COUNTS = struct.Struct("<III")
+LENGTH = struct.Struct("<I")
+
+def encode(preset: AvatarPreset, compression: int = COMPRESSION_ZLIB) -> bytes:
+    """
+    Encodes the preset in the compact format, or as minified json when it can't be.
+    """
+    try:
+        payload = _encode_payload(preset)
+    except (ValueError, OverflowError):
+        return encode_json(preset)
+    if compression == COMPRESSION_ZLIB:
+        payload = zlib.compress(payload, 6)
+    elif compression == COMPRESSION_LZMA:
+        payload = lzma.compress(payload, preset=1)
+    return MAGIC + bytes((VERSION, compression)) + payload
+
+def encode_json(preset: AvatarPreset) -> bytes:
+    return json.dumps(preset.to_dict(), separators=(",", ":")).encode()
+
+def decode(data: bytes | str) -> AvatarPreset:
+    """
+    Reads either format back, the json of older versions included.
+    """
+    if isinstance(data, str):
+        return AvatarPreset.from_dict(json.loads(data))
+    if not data.startswith(MAGIC):
+        return AvatarPreset.from_dict(json.loads(data))
+    version, compression = data[3], data[4]
+    if version != VERSION:
+        raise ValueError(f"Unsupported preset format version {version}")
+    payload = data[5:]
+    if compression == COMPRESSION_ZLIB:
+        payload = zlib.decompress(payload)
+    elif compression == COMPRESSION_LZMA:
+        payload = lzma.decompress(payload)
+    elif compression != COMPRESSION_NONE:
+        raise ValueError(f"Unknown preset compression {compression}")
+    return _decode_payload(payload)
+
+def _join(strings: list[str]) -> bytes:
+    for s in strings:
+        if "\0" in s:
+            raise ValueError("NUL in string")
+    block = "\0".join(strings).encode()
+    return LENGTH.pack(len(block)) + block
+
+def _encode_payload(preset: AvatarPreset) -> bytes:
+    rawNames = []
+    names = []
+    paths = []
+    types = bytearray()
+    floats = array("d")
+    ints = array("q")
+    strs = []
+    for p in preset.parameters:
+        rawName = p.rawName
+        rawNames.append(rawName)
+        names.append("" if p.name == rawName[rawName.rfind("/") + 1:] else p.name)
+        path = p.path
+        paths.append("" if path == PARAMETERS_PREFIX + rawName else path)
+        value = p.value
+        kind = type(value)
+        if value is None:
+            types.append(TYPE_NONE)
+        elif value is REMOVED:
+            types.append(TYPE_REMOVED)
+        elif kind is bool:
+            types.append(TYPE_TRUE if value else TYPE_FALSE)
+        elif kind is int:
+            types.append(TYPE_INT)
+            ints.append(value)
+        elif kind is float:
+            types.append(TYPE_FLOAT)
+            floats.append(value)
+        elif kind is str:
+            types.append(TYPE_STR)
+            strs.append(value)
+        else:
+            raise ValueError(f"Unsupported value {value!r}")
+    return b"".join((
+        COUNTS.pack(len(rawNames), len(floats), len(ints)),
+        _join([preset.name, preset.avatarId, preset.uniqueKey, preset.filterKey]),
+        _join(rawNames),
+        _join(names),
+        _join(paths),
+        _join(strs),
+        bytes(types),
+        floats.tobytes(),
+        ints.tobytes(),
+    ))
+
+def _decode_payload(payload: bytes) -> AvatarPreset:
+    count, floatCount, intCount = COUNTS.unpack_from(payload, 0)
+    offset = COUNTS.size
+    blocks = []
+    for _ in range(5):
+        (length,) = LENGTH.unpack_from(payload, offset)
+        offset += LENGTH.size
+        blocks.append(payload[offset:offset + length].decode().split("\0"))
+        offset += length
+    presetStrings, rawNames, names, paths, strs = blocks
+    types = payload[offset:offset + count]
+    offset += count
+    floats = array("d")
+    floats.frombytes(payload[offset:offset + floatCount * 8])
+    offset += floatCount * 8
+    ints = array("q")
+    ints.frombytes(payload[offset:offset + intCount * 8])
+
+    nextFloat = iter(floats).__next__
+    nextInt = iter(ints).__next__
+    nextStr = iter(strs).__next__
+    params = []
+    append = params.append
+    for i in range(count):
+        kind = types[i]
+        if kind == TYPE_FLOAT:
+            value = nextFloat()
+        elif kind == TYPE_TRUE:
+            value = True
+        elif kind == TYPE_FALSE:
+            value = False
+        elif kind == TYPE_INT:
+            value = nextInt()
+        elif kind == TYPE_STR:
+            value = nextStr()
+        elif kind == TYPE_REMOVED:
+            value = REMOVED
+        else:
+            value = None
+        rawName = rawNames[i]
+        path = paths[i] or PARAMETERS_PREFIX + rawName
+        append(AvatarParameter(names[i] or rawName[rawName.rfind("/") + 1:], path, value, rawName))
+    preset = AvatarPreset(presetStrings[0], presetStrings[1], params, presetStrings[3])
+    preset.uniqueKey = presetStrings[2]
+    return preset
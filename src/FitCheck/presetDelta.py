@@ -0,0 +1,52 @@
+from FitCheck.avatarParameter import AvatarParameter
+from FitCheck.avatarPreset import AvatarPreset
+from FitCheck.presetCodec import REMOVED
+
+# Presets of one avatar are stored as a delta against a shared base snapshot of that avatar:
+# the parameters whose value differs from the base (or that the base doesn't have),
+# and the base parameters the preset doesn't have, with REMOVED as value.
+
+def same_value(a, b) -> bool:
+    # exact, storing must give back the very same value
+    return type(a) is type(b) and a == b
+
+def make_delta(preset: AvatarPreset, base: list[AvatarParameter], baseIndex: dict) -> AvatarPreset:
+    """
+    Returns the preset as a delta against base. baseIndex maps path -> base parameter.
+    """
+    changed = []
+    present = set()
+    for p in preset.parameters:
+        path = p.path
+        present.add(path)
+        b = baseIndex.get(path)
+        if b is None or b.name != p.name or not same_value(b.value, p.value):
+            changed.append(p)
+    for b in base:
+        if b.path not in present:
+            changed.append(AvatarParameter(b.name, b.path, REMOVED, b.rawName))
+    delta = AvatarPreset(preset.name, preset.avatarId, changed, preset.filterKey)
+    delta.uniqueKey = preset.uniqueKey
+    return delta
+
+def apply_delta(delta: AvatarPreset, base: list[AvatarParameter]) -> AvatarPreset:
+    """
+    Materializes the full preset. Parameters equal to the base are the base's own objects, shared between presets.
+    """
+    overrides = {p.path: p for p in delta.parameters}
+    params = []
+    append = params.append
+    if overrides:
+        pop = overrides.pop
+        for b in base:
+            o = pop(b.path, None)
+            if o is None:
+                append(b)
+            elif o.value is not REMOVED:
+                append(o)
+        params.extend(o for o in overrides.values() if o.value is not REMOVED)
+    else:
+        params.extend(base)
+    preset = AvatarPreset(delta.name, delta.avatarId, params, delta.filterKey)
+    preset.uniqueKey = delta.uniqueKey
+    return preset
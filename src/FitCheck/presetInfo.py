@@ -0,0 +1,16 @@
+class PresetInfo():
+    __slots__ = ("avatarId", "name", "paramCount", "updatedAt", "size", "filterKey")
+    def __init__(self, avatarId: str, name: str, paramCount: int, updatedAt: float, size: int, filterKey: str = ""):
+        """
+        What the preset list needs to know about a preset, without its parameters. updatedAt is a unix timestamp, size is in bytes.
+        filterKey is the key of the blacklist the preset was filtered with, "" if never filtered.
+        """
+        self.avatarId = avatarId
+        self.name = name
+        self.paramCount = paramCount
+        self.updatedAt = updatedAt
+        self.size = size
+        self.filterKey = filterKey
+        pass
+    def __repr__(self):
+        return f"PresetInfo(avatarId={self.avatarId!r}, name={self.name!r}, paramCount={self.paramCount}, size={self.size})"
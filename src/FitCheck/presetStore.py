@@ -0,0 +1,264 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from FitCheck.avatarPreset import AvatarPreset
+from FitCheck.presetInfo import PresetInfo
+from FitCheck import presetCodec
+from FitCheck.presetDelta import make_delta, apply_delta
+from FitCheck.lruCache import LRUCache
+from FitCheck.logger import log
+
+SCHEMA_VERSION = 1
+# data stays the last column: listing the other ones never reads its overflow pages
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS presets (
+    avatarId TEXT NOT NULL,
+    name TEXT NOT NULL,
+    paramCount INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    updatedAt REAL NOT NULL,
+    baseHash TEXT, -- data is a delta against this base, NULL when data is the full preset
+    filterKey TEXT NOT NULL, -- key of the blacklist the preset was filtered with, "" if never filtered
+    data BLOB NOT NULL, -- presetCodec format
+    PRIMARY KEY (avatarId, name)
+);
+CREATE INDEX IF NOT EXISTS presets_base ON presets (baseHash);
+CREATE TABLE IF NOT EXISTS bases (
+    hash TEXT PRIMARY KEY,
+    avatarId TEXT NOT NULL,
+    createdAt REAL NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS bases_avatar ON bases (avatarId, createdAt);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS imported_files (
+    path TEXT PRIMARY KEY,
+    mtimeNs INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+"""
+
+class PresetStore():
+    def __init__(self, path: Path, dedup: bool = True):
+        """
+        Every preset of every avatar in one SQLite file, keyed by (avatarId, name).
+        Each write is its own transaction, the connection is shared between threads behind a lock
+        (AvatarManager writes from its background writer, reads from the UI thread).
+        With dedup, presets are stored as deltas against a per avatar base snapshot (see presetDelta),
+        so near identical presets cost the few values they change.
+        """
+        self.path = path
+        self.dedup = dedup
+        self._lock = threading.Lock()
+        self._bases = LRUCache(64) # hash -> (parameters, {path: parameter}), decoded once for every preset using it
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+            self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        pass
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def list_info(self) -> list[PresetInfo]:
+        """
+        Returns the metadata of every preset, sorted, without reading any parameter.
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT avatarId, name, paramCount, updatedAt, size, filterKey FROM presets ORDER BY avatarId, name").fetchall()
+        return [PresetInfo(*row) for row in rows]
+
+    def get(self, avatarId: str, name: str) -> AvatarPreset | None:
+        with self._lock:
+            row = self._conn.execute("SELECT baseHash, data FROM presets WHERE avatarId = ? AND name = ?", (avatarId, name)).fetchone()
+            if not row:
+                return None
+            baseHash, data = row
+            if baseHash is None:
+                return presetCodec.decode(data)
+            base, _ = self._load_base(baseHash)
+        return apply_delta(presetCodec.decode(data), base)
+
+    def put(self, preset: AvatarPreset) -> PresetInfo:
+        """
+        Inserts or replaces the preset.
+        """
+        with self._lock, self._conn:
+            return self._write(preset, time.time())
+
+    def delete(self, avatarId: str, name: str) -> bool:
+        with self._lock, self._conn:
+            deleted = self._conn.execute("DELETE FROM presets WHERE avatarId = ? AND name = ?", (avatarId, name)).rowcount > 0
+            self._drop_unused_bases(avatarId)
+            return deleted
+
+    def move(self, preset: AvatarPreset, oldName: str) -> PresetInfo:
+        """
+        Stores the preset and removes oldName of the same avatar in one transaction, this is how a rename is written.
+        """
+        with self._lock, self._conn:
+            info = self._write(preset, time.time())
+            if oldName != preset.name:
+                self._conn.execute("DELETE FROM presets WHERE avatarId = ? AND name = ?", (preset.avatarId, oldName))
+                self._drop_unused_bases(preset.avatarId)
+        return info
+
+    def _write(self, preset: AvatarPreset, updatedAt: float) -> PresetInfo:
+        # call with the lock held, inside a transaction
+        data, baseHash = self._encode(preset)
+        info = PresetInfo(preset.avatarId, preset.name, len(preset.parameters), updatedAt, len(data), preset.filterKey)
+        self._conn.execute(
+            "INSERT OR REPLACE INTO presets (avatarId, name, paramCount, size, updatedAt, baseHash, filterKey, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (info.avatarId, info.name, info.paramCount, info.size, info.updatedAt, baseHash, info.filterKey, data),
+        )
+        return info
+
+    def _encode(self, preset: AvatarPreset) -> tuple[bytes, str | None]:
+        """
+        Returns (data, baseHash). Uses the newest base of the avatar, and makes the preset itself the new base
+        when more than half of its parameters would differ from it.
+        """
+        if not self.dedup:
+            return encode_preset(preset), None
+        row = self._conn.execute(
+            "SELECT hash FROM bases WHERE avatarId = ? ORDER BY createdAt DESC LIMIT 1", (preset.avatarId,)
+        ).fetchone()
+        delta = None
+        if row:
+            baseHash = row[0]
+            delta = make_delta(preset, *self._load_base(baseHash))
+        if delta is None or len(delta.parameters) * 2 > len(preset.parameters):
+            baseHash = self._add_base(preset)
+            delta = make_delta(preset, *self._load_base(baseHash))
+        try:
+            data = encode_preset(delta)
+        except TypeError: # fell back to json, which can't hold REMOVED
+            data = None
+        if data is None or not data.startswith(presetCodec.MAGIC):
+            # only the compact format can hold a delta, such presets are stored whole
+            return encode_preset(preset), None
+        return data, baseHash
+
+    def _add_base(self, preset: AvatarPreset) -> str:
+        base = AvatarPreset("", preset.avatarId, preset.parameters)
+        raw = presetCodec.encode(base, presetCodec.COMPRESSION_NONE)
+        baseHash = hashlib.sha256(raw).hexdigest()[:32] # same content, same base
+        self._conn.execute(
+            "INSERT OR IGNORE INTO bases (hash, avatarId, createdAt, data) VALUES (?, ?, ?, ?)",
+            (baseHash, preset.avatarId, time.time(), presetCodec.encode(base)),
+        )
+        return baseHash
+
+    def _load_base(self, baseHash: str):
+        cached = self._bases.get(baseHash)
+        if cached is None:
+            row = self._conn.execute("SELECT data FROM bases WHERE hash = ?", (baseHash,)).fetchone()
+            if not row:
+                raise KeyError(f"Missing base {baseHash}")
+            base = presetCodec.decode(row[0]).parameters
+            cached = (base, {p.path: p for p in base})
+            self._bases.put(baseHash, cached)
+        return cached
+
+    def _drop_unused_bases(self, avatarId: str):
+        self._conn.execute(
+            "DELETE FROM bases WHERE avatarId = ? AND hash NOT IN (SELECT baseHash FROM presets WHERE avatarId = ? AND baseHash IS NOT NULL)",
+            (avatarId, avatarId),
+        )
+
+    def compact(self, batch: int = 200) -> int:
+        """
+        With dedup, re-encodes the presets stored whole (written without dedup) as deltas, batch rows per transaction.
+        Returns the number of rows converted.
+        """
+        if not self.dedup:
+            return 0
+        converted = 0
+        lastRow = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT rowid, updatedAt, data FROM presets WHERE baseHash IS NULL AND rowid > ? ORDER BY rowid LIMIT ?",
+                    (lastRow, batch)
+                ).fetchall()
+            if not rows:
+                return converted
+            presets = []
+            for rowid, updatedAt, data in rows:
+                lastRow = rowid
+                try:
+                    presets.append((presetCodec.decode(data), updatedAt, rowid, data))
+                except (ValueError, KeyError) as exc:
+                    log.warning("store", "leaving unreadable preset row %s as is: %s", rowid, exc)
+            with self._lock, self._conn:
+                for preset, updatedAt, rowid, data in presets:
+                    # rows rewritten in the meantime are left alone
+                    if not self._conn.execute("SELECT 1 FROM presets WHERE rowid = ? AND data = ?", (rowid, data)).fetchone():
+                        continue
+                    self._write(preset, updatedAt)
+                    converted += 1
+
+    def get_meta(self, key: str) -> str | None:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def data_version(self) -> int:
+        """
+        Changes whenever another connection (another FitCheck, a copied database) commits. Our own writes don't change it.
+        """
+        with self._lock:
+            return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def import_directory(self, presetsDir: Path) -> list[PresetInfo]:
+        """
+        Imports presets/<avatarId>/<name>.json files that are new or changed since the last import, in a single transaction.
+        Files are compared by mtime and size against the imported_files manifest, unchanged ones are never opened.
+        The directory is left untouched. Returns the imported presets.
+        """
+        if not presetsDir.is_dir():
+            return []
+        with self._lock:
+            known = {path: (mtimeNs, size) for path, mtimeNs, size in self._conn.execute("SELECT path, mtimeNs, size FROM imported_files")}
+        seen = set()
+        manifest = []
+        rows = []
+        infos = []
+        for avatar_dir in sorted(p for p in presetsDir.iterdir() if p.is_dir() and not p.name.startswith(".")):
+            for blob in sorted(avatar_dir.glob("*.json")):
+                key = f"{avatar_dir.name}/{blob.name}"
+                stat = blob.stat()
+                seen.add(key)
+                if known.get(key) == (stat.st_mtime_ns, stat.st_size):
+                    continue
+                manifest.append((key, stat.st_mtime_ns, stat.st_size))
+                try:
+                    preset = AvatarPreset.from_dict(json.loads(blob.read_text()))
+                except (ValueError, KeyError) as exc:
+                    log.warning("store", "skipping unreadable preset %s: %s", blob, exc)
+                    continue
+                preset.avatarId = avatar_dir.name
+                preset.name = blob.stem
+                rows.append((preset, stat.st_mtime))
+        gone = [(key,) for key in known if key not in seen]
+        if not manifest and not gone:
+            return []
+        with self._lock, self._conn:
+            for preset, updatedAt in rows:
+                infos.append(self._write(preset, updatedAt))
+            self._conn.executemany("INSERT OR REPLACE INTO imported_files (path, mtimeNs, size) VALUES (?, ?, ?)", manifest)
+            self._conn.executemany("DELETE FROM imported_files WHERE path = ?", gone)
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migratedFrom', ?)", (str(presetsDir),))
+        return infos
+
+def encode_preset(preset: AvatarPreset) -> bytes:
+    return presetCodec.encode(preset)
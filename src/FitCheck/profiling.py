@@ -0,0 +1,141 @@
+import cProfile
+import functools
+import inspect
+import io
+import itertools
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+from FitCheck.logger import log
+
+class Profiler():
+    def __init__(self, enabled: bool = False, topFunctions: int = 40, topAllocations: int = 25):
+        """
+        Opt-in profiling of the operations decorated with profiled(). While enabled, every outermost call runs under
+        cProfile and tracemalloc, and leaves a report in profiles/ of the data directory: <stamp>-<operation>-<n>.txt
+        (slowest functions, biggest allocations) and the raw .prof for snakeviz or pstats.
+        Calls made inside a profiled one are part of its report. Disabled, a profiled call costs one attribute check.
+        """
+        self.enabled = enabled
+        self.topFunctions = topFunctions
+        self.topAllocations = topAllocations
+        self.outputDir: Path | None = None # profiles/ in FLET_APP_STORAGE_DATA when None
+        self.reports: list[Path] = []
+        self._serial = itertools.count(1)
+        self._local = threading.local() # depth of profiled calls on this thread
+        self._tracing = 0 # operations using tracemalloc, it's process wide
+        self._startedTracing = False # left alone when something else traces already
+        self._lock = threading.Lock()
+        pass
+
+    def _report_dir(self) -> Path | None:
+        if self.outputDir is not None:
+            return self.outputDir
+        dataDir = os.getenv("FLET_APP_STORAGE_DATA")
+        return Path(dataDir) / "profiles" if dataDir else None
+
+    def _enter(self):
+        depth = getattr(self._local, "depth", 0)
+        self._local.depth = depth + 1
+        if depth or not self.enabled:
+            return None
+        with self._lock:
+            if self._tracing == 0:
+                self._startedTracing = not tracemalloc.is_tracing()
+                if self._startedTracing:
+                    tracemalloc.start(10)
+            self._tracing += 1
+        before = tracemalloc.take_snapshot()
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError: # another profiler owns the interpreter (3.12+ allows one at a time)
+            self._stop_tracing()
+            return None
+        return profile, before, time.perf_counter()
+
+    def _exit(self, name: str, state, error: BaseException | None):
+        self._local.depth -= 1
+        if state is None:
+            return
+        profile, before, start = state
+        profile.disable()
+        elapsed = time.perf_counter() - start
+        current, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+        self._stop_tracing()
+        try:
+            self._write_report(name, profile, before, after, elapsed, current, peak, error)
+        except OSError as exc:
+            log.warning("profile", "could not write the report of %s: %s", name, exc)
+
+    def _stop_tracing(self):
+        with self._lock:
+            self._tracing -= 1
+            if self._tracing == 0 and self._startedTracing:
+                tracemalloc.stop()
+
+    def _write_report(self, name, profile, before, after, elapsed, current, peak, error):
+        folder = self._report_dir()
+        if folder is None:
+            log.warning("profile", "no data directory, report of %s not written", name)
+            return
+        folder.mkdir(parents=True, exist_ok=True)
+        base = folder / f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{next(self._serial)}"
+        out = io.StringIO()
+        out.write(f"{name} on {threading.current_thread().name}: {elapsed * 1000:.1f} ms")
+        out.write(f", failed: {error!r}\n" if error else "\n")
+        out.write(f"traced memory: {current / 1024:.1f} KiB now, {peak / 1024:.1f} KiB peak (since profiling started)\n")
+        out.write("async operations also count what ran on the loop in the meantime\n\n")
+        out.write(f"--- top {self.topFunctions} functions by cumulative time ---\n")
+        pstats.Stats(profile, stream=out).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.topFunctions)
+        out.write(f"--- top {self.topAllocations} allocation sites during the operation ---\n")
+        for stat in after.compare_to(before, "lineno")[:self.topAllocations]:
+            out.write(f"{stat}\n")
+        base.with_suffix(".txt").write_text(out.getvalue(), encoding="utf-8")
+        profile.dump_stats(str(base.with_suffix(".prof")))
+        self.reports.append(base.with_suffix(".txt"))
+        log.info("profile", "%s took %.1f ms, report in %s", name, elapsed * 1000, base.with_suffix(".txt"))
+
+def profiled(name: str):
+    """
+    Decorator for the operations profiling mode covers, name goes into the report file names.
+    Works on plain and async functions.
+    """
+    def decorate(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def run_async(*args, **kwargs):
+                if not profiler.enabled:
+                    return await fn(*args, **kwargs)
+                state = profiler._enter()
+                error = None
+                try:
+                    return await fn(*args, **kwargs)
+                except BaseException as exc:
+                    error = exc
+                    raise
+                finally:
+                    profiler._exit(name, state, error)
+            return run_async
+        @functools.wraps(fn)
+        def run(*args, **kwargs):
+            if not profiler.enabled:
+                return fn(*args, **kwargs)
+            state = profiler._enter()
+            error = None
+            try:
+                return fn(*args, **kwargs)
+            except BaseException as exc:
+                error = exc
+                raise
+            finally:
+                profiler._exit(name, state, error)
+        return run
+    return decorate
+
+# FITCHECK_PROFILE=1 turns profiling on from the start, the UI can toggle it later
+profiler = Profiler(enabled=os.getenv("FITCHECK_PROFILE", "") not in ("", "0"))
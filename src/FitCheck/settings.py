@@ -1,61 +1,74 @@
 from typing import Dict
 from pathlib import Path
 
+DEFAULT_BLACKLIST_INDIVIDUAL = [
+    "TrackingTypeProxy",
+    "CgeSmiling",
+    "VRModeProxy",
+    "VelocityX",
+    "VelocityY",
+    "VelocityZ",
+    "AngularY",
+    "Grounded",
+    "AFK",
+    "Upright",
+    "TrackingType",
+    "VRMode",
+    "MuteSelf",
+    "Voice",
+    "Earmuffs",
+    "VelocityMagnitude",
+    "ScaleFactor",
+    "ScaleFactorInverse",
+    "ScaleModified",
+    "EyeHeightAsPercent",
+    "EyeHeightAsMeters",
+    "IsOnFriendsList",
+    "IsAnimatorEnabled",
+    "Viseme",
+    "GestureLeft",
+    "GestureRight",
+    "GestureLeftWeight",
+    "GestureRightWeight",
+    "Seated",
+    "InStation",
+    "PreviewMode",
+    "VRCEmote",
+    "VRCFaceBlendH",
+    "VRCFaceBlendV",
+    "VRMode"
+]
+DEFAULT_BLACKLIST_PARTIAL = [
+    "OGB",
+    "VF10",
+    "Go",
+    "VFH",
+    "VF_",
+    "FT/v2"
+]
+
 class Settings():
-    def __init__(self, isLightMode, avatarIdAssociations):
-        self.blacklistIndividual = [
-            "TrackingTypeProxy",
-            "CgeSmiling",
-            "VRModeProxy",
-            "VelocityX",
-            "VelocityY",
-            "VelocityZ",
-            "AngularY",
-            "Grounded",
-            "AFK",
-            "Upright",
-            "TrackingType",
-            "VRMode",
-            "MuteSelf",
-            "Voice",
-            "Earmuffs",
-            "VelocityMagnitude",
-            "ScaleFactor",
-            "ScaleFactorInverse",
-            "ScaleModified",
-            "EyeHeightAsPercent",
-            "EyeHeightAsMeters",
-            "IsOnFriendsList",
-            "IsAnimatorEnabled",
-            "Viseme",
-            "GestureLeft",
-            "GestureRight",
-            "GestureLeftWeight",
-            "GestureRightWeight",
-            "Seated",
-            "InStation",
-            "PreviewMode",
-            "VRCEmote",
-            "VRCFaceBlendH",
-            "VRCFaceBlendV",
-            "VRMode"
-        ]
-        self.blacklistPartial = [
-            "OGB",
-            "VF10",
-            "Go",
-            "VFH",
-            "VF_"
-            "FT/v2"
-        ]
+    def __init__(self, isLightMode, avatarIdAssociations, blacklistIndividual=None, blacklistPartial=None):
+        self.blacklistIndividual: list[str] = list(blacklistIndividual if blacklistIndividual is not None else DEFAULT_BLACKLIST_INDIVIDUAL)
+        self.blacklistPartial: list[str] = list(blacklistPartial if blacklistPartial is not None else DEFAULT_BLACKLIST_PARTIAL)
         self.avatarIdAssociations = avatarIdAssociations #"avId": userProvidedName
         self.isLightMode: bool = isLightMode
         pass
     def from_dict(d: dict) -> "Settings":
-        return Settings(isLightMode=d["isLightMode"], avatarIdAssociations=d["avatarIdAssociations"])
+        blacklist = d.get("blacklist", {})
+        return Settings(
+            isLightMode=d["isLightMode"],
+            avatarIdAssociations=d["avatarIdAssociations"],
+            blacklistIndividual=blacklist.get("individual"),
+            blacklistPartial=blacklist.get("partial"),
+        )
 
     def to_dict(self):
-        return {"isLightMode": self.isLightMode, "avatarIdAssociations": self.avatarIdAssociations}
+        d = {"isLightMode": self.isLightMode, "avatarIdAssociations": self.avatarIdAssociations}
+        # only a customized blacklist is saved, so users keep getting the updated defaults
+        if self.blacklistIndividual != DEFAULT_BLACKLIST_INDIVIDUAL or self.blacklistPartial != DEFAULT_BLACKLIST_PARTIAL:
+            d["blacklist"] = {"individual": self.blacklistIndividual, "partial": self.blacklistPartial}
+        return d
 
     def associate_name_to_avatar(self, name: str, avatar_id: str):
         self.avatarIdAssociations[avatar_id] = name
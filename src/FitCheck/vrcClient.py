@@ -1,10 +1,17 @@
 import requests
-from FitCheck.avatarParameter import AvatarParameter
+from requests.adapters import HTTPAdapter
+from FitCheck.avatarParameter import AvatarParameter, PARAMETERS_PREFIX
 from pythonosc.udp_client import SimpleUDPClient
+from pythonosc.osc_message_builder import build_msg
+from pythonosc.osc_bundle_builder import OscBundleBuilder, IMMEDIATELY
 from pythonosc.dispatcher import Dispatcher
 from pythonosc.osc_server import BlockingOSCUDPServer
 import threading
 import time
+import math
+from FitCheck.logger import log
+from FitCheck.profiling import profiled
+from FitCheck.metrics import metrics
 
 class VRCClient():
     def __init__(self, oscqPort: int):
@@ -13,133 +20,438 @@ class VRCClient():
         self.client = SimpleUDPClient(self.ip, self.port)
         self.oscqport: int = oscqPort
         self.currentAvatarRaw = {}
+        self.httpTimeout = (0.5, 3.0) # connect, read. A hung game should fail the call, not freeze the UI
+        self.nodeCacheTtl: float = 0.25 # seconds a fetched node can be reused, one save/apply only fetches once
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=0))
+        self._nodeCache: dict[str, CachedNode] = {}
+        self.pathQueries: bool | None = None # whether the server answers /some/path with just that node, None until we know
+        self._cacheLock = threading.Lock()
+        self.bundleMaxSize: int = 4096 # bytes per datagram, keeps us well under what VRChat reads in one go
+        self.bundleInterval: float = 0.01 # seconds to wait between two bundles
+        self.listenPort = 9001 #vrchat sends its messages there
+        self.liveAvatarId: str | None = None
+        self.pendingAvatarId: str | None = None # target of a change_avatar the game hasn't confirmed yet, the avatar is unknown meanwhile
+        self.liveParams: dict = {} # "/avatar/parameters/..." -> last value seen, mirror of the game state
+        self.mirrorSeeded = False # liveParams was filled from OSCQuery for the current avatar
+        self._mirrorLock = threading.Lock()
+        self._stateChanged = threading.Condition(self._mirrorLock) # notified on avatar change and when a ready waiter is satisfied
+        self._readyWaiters: list[ReadyCondition] = []
+        self._server: BlockingOSCUDPServer | None = None
+        self._serverThread: threading.Thread | None = None
+        self._seedingPaths: set | None = None
+        self._changeSerial = 0 # bumped on every /avatar/change
+        self._switchSerial: int | None = None
+        self._seenSinceChange: set = set()
+        self._lastNewNameTs = 0.0
+        self.probeTimeout: float = 0.25 # seconds, the game answers on localhost in a few ms when it's alive
+        self.lastAlive = 0.0 # monotonic time of the last sign of life, an OSCQuery answer or an OSC message
         #some code to get the config ? maybe ?
     def send_param_change(self, path, param):
         """
         Will send a message to VRChat with OSC. Returns nothing.
         """
         self.client.send_message(path, param) #should work for any type of parameter
+    def send_param_changes(self, params, max_bundle_size: int | None = None, interval: float | None = None) -> int:
+        """
+        Sends many (path, value) pairs to VRChat packed into OSC bundles, each bundle
+        staying under max_bundle_size bytes, waiting interval seconds between bundles.
+        Returns the number of bundles sent.
+        """
+        maxSize = self.bundleMaxSize if max_bundle_size is None else max_bundle_size
+        pause = self.bundleInterval if interval is None else interval
+        sent = 0
+        for bundle in build_bundles(params, maxSize):
+            if sent and pause > 0:
+                time.sleep(pause)
+            self.client.send(bundle)
+            sent += 1
+        return sent
     def change_avatar(self, avatarId: str):
+        self.invalidate_cache()
+        with self._mirrorLock:
+            self._switchSerial = self._changeSerial # wait_for_avatar_ready waits for a change after this one
+            self.pendingAvatarId = avatarId
         self.send_param_change("/avatar/change", avatarId)
-    def get_root_node(self):
+    def start_listener(self):
+        """
+        Starts the OSC receiver on listenPort that keeps liveAvatarId and liveParams up to date. Raises OSError if the port is taken.
+        """
+        if self._server is not None:
+            return
+        disp = Dispatcher()
+        disp.map("/avatar/change", self._on_avatar_change)
+        disp.set_default_handler(self._on_osc_message) # "*" would not match nested parameter names like FT/v2/...
+        self._server = BlockingOSCUDPServer((self.ip, self.listenPort), disp)
+        self._serverThread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._serverThread.start()
+    def stop_listener(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
+        self._serverThread = None
+        with self._mirrorLock:
+            self.mirrorSeeded = False
+    def is_listening(self) -> bool:
+        return self._server is not None
+    def close(self):
+        self.stop_listener()
+        self.session.close()
+    def _on_avatar_change(self, addr, *args):
+        if not args:
+            return
+        self.lastAlive = time.monotonic()
+        with self._mirrorLock:
+            self.liveAvatarId = args[0]
+            if self.pendingAvatarId == args[0]:
+                self.pendingAvatarId = None
+            self.liveParams.clear()
+            self.mirrorSeeded = False # parameters of the new avatar get seeded again on next read
+            self._changeSerial += 1
+            self.invalidate_cache()
+            self._seenSinceChange.clear()
+            self._lastNewNameTs = 0.0
+            for waiter in self._readyWaiters:
+                waiter.enough = False
+            self._stateChanged.notify_all()
+        log.info("osc", "/avatar/change %s", args[0])
+    def _on_osc_message(self, addr, *args):
+        if not addr.startswith(PARAMETERS_PREFIX) or not args:
+            return
+        self.lastAlive = time.monotonic()
+        with self._mirrorLock:
+            self.liveParams[addr] = args[0] if len(args) == 1 else list(args)
+            if self._seedingPaths is not None:
+                self._seedingPaths.add(addr)
+            if self._changeSerial and addr not in self._seenSinceChange:
+                self._seenSinceChange.add(addr)
+                self._lastNewNameTs = time.monotonic()
+                for waiter in self._readyWaiters:
+                    if not waiter.enough and waiter.check(self._seenSinceChange):
+                        self._stateChanged.notify_all()
+    def sync_mirror(self, max_age: float | None = None):
+        """
+        Rebuilds the live mirror from OSCQuery, parameters the avatar no longer has are dropped.
+        Values received over OSC while the fetch was running are kept.
+        max_age applies to the /avatar/parameters fetch, 0 always asks the game.
+        """
+        with self._mirrorLock:
+            self._seedingPaths = set()
+            serial = self._changeSerial
+        try:
+            avatarId = read_avatar_id(self.get_node("/avatar/change"))
+            values = read_live_values(self.get_node("/avatar/parameters", max_age))
+        except Exception:
+            with self._mirrorLock:
+                self._seedingPaths = None
+            raise
+        with self._mirrorLock:
+            updated = self._seedingPaths
+            self._seedingPaths = None
+            if self._changeSerial != serial:
+                return # the avatar changed during the fetch, what was fetched may be the old one
+            if avatarId is not None and avatarId != self.liveAvatarId:
+                # another avatar than the mirror knows (no listener to see the change), nothing of the old one is kept
+                self.liveAvatarId = avatarId
+                updated = set()
+            if avatarId is not None and avatarId == self.pendingAvatarId:
+                self.pendingAvatarId = None
+            # rebuilt from the game, only values received over OSC during the fetch are newer than it
+            values.update((path, self.liveParams[path]) for path in updated if path in self.liveParams)
+            self.liveParams = values
+            self.mirrorSeeded = True
+    def ensure_mirror(self):
+        """
+        Makes sure the mirror can be read. Without a running listener every read is a fresh OSCQuery fetch.
+        """
+        if not self.is_listening() or not self.mirrorSeeded:
+            self.sync_mirror()
+    def get_root_node(self, max_age: float | None = None):
         """
         Gets the current avatar state, and returns it. Can be retrieved with the currentAvatarRaw attribute
+        A fetch younger than max_age seconds (nodeCacheTtl by default) is reused.
         """
-        self.currentAvatarRaw.clear()
-        req = requests.get(f'http://{self.ip}:{self.oscqport}')
-        req.raise_for_status()
-        data = req.json()
+        data = self.fetch_node("/", max_age)
         self.currentAvatarRaw = data
         return data
+    @profiled("fetch_node")
+    def fetch_node(self, path: str, max_age: float | None = None):
+        """
+        GETs an OSCQuery node over the pooled session. Sends the validators of the previous answer, and only
+        parses the body again when the game says or shows it changed.
+        """
+        ttl = self.nodeCacheTtl if max_age is None else max_age
+        with self._cacheLock:
+            cached = self._nodeCache.get(path)
+        if cached and time.monotonic() - cached.fetchedAt <= ttl:
+            metrics.inc("oscq.cache_hits")
+            return cached.data
+        headers = {}
+        if cached and cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached and cached.lastModified:
+            headers["If-Modified-Since"] = cached.lastModified
+        metrics.inc("oscq.fetches")
+        with metrics.timer("oscq.fetch"):
+            req = self.session.get(f'http://{self.ip}:{self.oscqport}{path}', headers=headers, timeout=self.httpTimeout)
+            if req.status_code == 304 and cached:
+                metrics.inc("oscq.not_modified")
+                data = cached.data
+                body = cached.body
+            else:
+                req.raise_for_status()
+                body = req.content
+                metrics.inc("oscq.bytes_fetched", len(body))
+                data = cached.data if cached and cached.body == body else req.json()
+        self.lastAlive = time.monotonic()
+        with self._cacheLock:
+            self._nodeCache[path] = CachedNode(data, body, req.headers.get("ETag"), req.headers.get("Last-Modified"))
+        return data
+    def probe(self, timeout: float | None = None) -> bool:
+        """
+        Cheap health check of the known OSCQuery endpoint: asks for HOST_INFO with a short timeout, without reading the tree.
+        Any HTTP answer means the game is there.
+        """
+        wait = self.probeTimeout if timeout is None else timeout
+        try:
+            with self.session.get(f'http://{self.ip}:{self.oscqport}/?HOST_INFO', timeout=(wait, wait), stream=True):
+                pass
+        except requests.RequestException:
+            return False
+        self.lastAlive = time.monotonic()
+        return True
+    def is_alive(self, max_age: float = 1.0) -> bool:
+        """
+        True if the game showed up in the last max_age seconds, probes it otherwise.
+        """
+        if time.monotonic() - self.lastAlive <= max_age:
+            return True
+        return self.probe()
+    def get_node(self, path: str, max_age: float | None = None):
+        """
+        Returns the OSCQuery node at path (e.g. /avatar/change) by asking for that path only.
+        Falls back to walking the root node when the server doesn't answer per path queries.
+        """
+        if self.pathQueries is not False:
+            try:
+                node = self.fetch_node(path, max_age)
+            except requests.HTTPError as exc:
+                # only a 4xx on a server never queried per path says it can't do it, it worked before: the node is just not there.
+                # Timeouts and lost connections are the game failing, they don't tell us anything
+                status = exc.response.status_code if exc.response is not None else 0
+                if self.pathQueries or not 400 <= status < 500:
+                    raise
+            else:
+                if isinstance(node, dict) and node.get("FULL_PATH", path) == path:
+                    self.pathQueries = True
+                    return node
+        node = node_at(self.get_root_node(max_age), path)
+        self.pathQueries = False
+        return node
+    def invalidate_cache(self):
+        """
+        Forgets every fetched node, the next fetch hits the game again. Validators are dropped too.
+        """
+        with self._cacheLock:
+            self._nodeCache.clear()
     def get_avatar_id(self) -> str:
         """
-        Returns the current avatar ID, name, author, etc. from OSCQuery root.
+        Returns the current avatar ID from the live mirror, or from a /avatar/change query when the listener doesn't know it.
         """
-        self.get_root_node()
-        avatarChange = self.currentAvatarRaw["CONTENTS"]["avatar"]["CONTENTS"]["change"]
-        avatarId = avatarChange.get("VALUE")[0]
+        if self.is_listening():
+            with self._mirrorLock:
+                if self.liveAvatarId is not None:
+                    return self.liveAvatarId
+        avatarId = read_avatar_id(self.get_node("/avatar/change"))
+        with self._mirrorLock:
+            self.liveAvatarId = avatarId
+            if avatarId == self.pendingAvatarId:
+                self.pendingAvatarId = None
         return avatarId
-    def get_avatar_params(self) -> list[AvatarParameter]:
+    def get_avatar_params(self, with_meta=False) -> list[AvatarParameter]:
+        """
+        Returns a list of avatar parameters, from the live mirror.
+        with_meta reads them from OSCQuery instead, with their type/range/tags in meta.
         """
-        Returns a list of avatar parameters
+        if with_meta:
+            return walk_parameters(self.get_node("/avatar/parameters"), with_meta=True)
+        self.ensure_mirror()
+        with self._mirrorLock:
+            values = list(self.liveParams.items())
+        return [AvatarParameter(path[path.rfind("/") + 1:], path, value, path[len(PARAMETERS_PREFIX):]) for path, value in values]
+    def get_live_values(self, resync: bool = False) -> dict:
         """
-        self.get_root_node() # Refresh data
-        avatar_node = self.currentAvatarRaw["CONTENTS"]["avatar"]["CONTENTS"]["parameters"]
-        params = list(walk_node(avatar_node, "/avatar/parameters"))
-        paramList: list[AvatarParameter] = []
-        for p in params:
-            paramName = str(p['path']).split("/")[-1] #strip path prefix
-            param = AvatarParameter(paramName, p['path'], p['value'])
-            paramList.append(param)
-        return paramList
-    def wait_for_avatar_ready(self, timeout=60, min_params=10, quiet_ms=400, required_params=None):
+        Returns {path: value} for every avatar parameter, from the live mirror.
+        resync reads /avatar/parameters from the game first, so a missed OSC message can't leave a stale value behind.
+        """
+        if resync:
+            self.sync_mirror(max_age=0)
+        else:
+            self.ensure_mirror()
+        with self._mirrorLock:
+            return dict(self.liveParams)
+    def wait_for_avatar_ready(self, timeout=60, min_params=10, quiet_ms=400, required_params=None, avatar_id=None):
         """
         Wait for: /avatar/change -> enough distinct /avatar/parameters/*
         -> no *new* parameter names for quiet_ms.
-        Returns avatar_id, raises TimeoutError on timeout.
-        """
-        required = set(required_params or [])
-        state = {
-            "avatar_id": None,
-            "seen": set(),                # distinct parameter names
-            "last_new_name_ts": 0.0,      # only updated when a *new* name is observed
-            "change_ts": 0.0,
-        }
+        With avatar_id, a change to another avatar (an earlier switch landing late) doesn't count.
+        Woken up by the listener, a change sent through change_avatar before calling this is not missed.
+        Returns the avatar id, raises TimeoutError on timeout.
+        """
+        self.start_listener()
+        required = set(PARAMETERS_PREFIX + name for name in (required_params or []))
+        waiter = ReadyCondition(min_params, required)
+        quiet = quiet_ms / 1000.0
+        deadline = time.monotonic() + timeout
+        with self._stateChanged:
+            baseline = self._switchSerial if self._switchSerial is not None else self._changeSerial
+            self._switchSerial = None
+            self._readyWaiters.append(waiter)
+            if self._changeSerial > baseline:
+                waiter.check(self._seenSinceChange) # the change and its flood may have landed before we got here
+            try:
+                while True:
+                    now = time.monotonic()
+                    if self._changeSerial <= baseline or (avatar_id and self.liveAvatarId != avatar_id):
+                        # 1) wait for /avatar/change
+                        wake_at = deadline
+                        error = "No /avatar/change received within timeout"
+                    elif not waiter.enough:
+                        # 2) wait until enough distinct params have appeared
+                        wake_at = deadline
+                        error = "Avatar did not expose enough parameters in time"
+                    else:
+                        # 3) debounce: no *new* names for quiet_ms, the deadline moves with every new name
+                        quiet_end = self._lastNewNameTs + quiet
+                        if now >= quiet_end:
+                            readyId = self.liveAvatarId
+                            seen = len(self._seenSinceChange)
+                            break
+                        wake_at = min(quiet_end, deadline)
+                        error = "Avatar did not expose enough parameters in time"
+                    if now >= deadline:
+                        raise TimeoutError(error)
+                    self._stateChanged.wait(wake_at - now)
+            finally:
+                self._readyWaiters.remove(waiter)
+        log.info("osc", "avatar %s ready with %d parameters", readyId, seen)
+        return readyId
+    
+class CachedNode():
+    def __init__(self, data, body: bytes, etag: str | None, lastModified: str | None):
+        self.data = data
+        self.body = body # raw answer, an identical answer reuses data instead of being parsed again
+        self.etag = etag
+        self.lastModified = lastModified
+        self.fetchedAt = time.monotonic()
+        pass
 
-        def on_change(addr, *args):
-            if not args:
-                return
-            avatar_id = args[0]
-            # reset state
-            state["avatar_id"] = avatar_id
-            state["seen"].clear()
-            state["last_new_name_ts"] = 0.0
-            state["change_ts"] = time.monotonic()
-            print(f"[osc] /avatar/change {avatar_id}")
+class ReadyCondition():
+    def __init__(self, min_params: int, required: set):
+        """
+        What wait_for_avatar_ready needs to see before debouncing. enough is updated by the listener thread.
+        """
+        self.minParams = min_params
+        self.required = required
+        self.enough = False
+        pass
+    def check(self, seen: set) -> bool:
+        self.enough = bool(self.required and self.required.issubset(seen)) or len(seen) >= self.minParams
+        return self.enough
 
-        def on_param(addr, *args):
-            # only track after we've seen /avatar/change
-            if not state["avatar_id"]:
-                return
-            # param name = last path segment
-            pname = addr.rsplit("/", 1)[-1]
-            if pname not in state["seen"]:
-                state["seen"].add(pname)
-                state["last_new_name_ts"] = time.monotonic()
-                # print(f"[osc] new param: {pname} (count={len(state['seen'])})")
+def read_avatar_id(node):
+    """Reads the avatar id off the /avatar/change node, None if it has no value."""
+    value = node.get("VALUE") if node else None
+    return value[0] if value else None
 
-        disp = Dispatcher()
-        disp.map("/avatar/change", on_change)
-        disp.map("/avatar/parameters/*", on_param)
+@profiled("read_live_values")
+def read_live_values(node) -> dict:
+    """Returns {path: value} for every parameter under the /avatar/parameters node."""
+    values = {}
+    for rawName, name, leaf in iter_leaves(node):
+        value = leaf.get("VALUE")
+        values[PARAMETERS_PREFIX + rawName] = value[0] if type(value) is list and value else value
+    return values
 
-        server = BlockingOSCUDPServer(("127.0.0.1", 9001), disp)
-        t = threading.Thread(target=server.serve_forever, daemon=True)
-        t.start()
+def node_at(root, path: str):
+    """Walks CONTENTS from the root node down to path, raises KeyError if it isn't there."""
+    node = root
+    for name in path.strip("/").split("/"):
+        if name:
+            node = node["CONTENTS"][name]
+    return node
 
-        deadline = time.monotonic() + timeout
-        try:
-            # 1) wait for /avatar/change
-            while not state["avatar_id"]:
-                if time.monotonic() > deadline:
-                    raise TimeoutError("No /avatar/change received within timeout")
-                time.sleep(0.01)
+def values_equal(a, b) -> bool:
+    """Compares two parameter values, floats are compared loosely since OSC floats are 32 bits."""
+    if type(a) is float or type(b) is float:
+        if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+            return math.isclose(a, b, rel_tol=1e-6, abs_tol=1e-5)
+        return False
+    return a == b
 
-            # 2) wait until enough distinct params have appeared
-            while True:
-                if time.monotonic() > deadline:
-                    raise TimeoutError("Avatar did not expose enough parameters in time")
+BUNDLE_HEADER_SIZE = 16 # "#bundle\0" + timetag
+BUNDLE_ELEMENT_OVERHEAD = 4 # size prefix of every element
 
-                seen = state["seen"]
-                enough = (required and required.issubset(seen)) or (len(seen) >= min_params)
-                if not enough:
-                    time.sleep(0.02)
-                    continue
+def build_bundles(params, max_size: int):
+    """Packs (path, value) pairs into OSC bundles of at most max_size bytes.
+    A message too large to share a bundle is sent in a bundle of its own."""
+    builder = None
+    size = 0
+    for path, value in params:
+        msg = build_msg(path, value)
+        msgSize = BUNDLE_ELEMENT_OVERHEAD + msg.size
+        if builder is not None and size + msgSize > max_size:
+            yield builder.build()
+            builder = None
+        if builder is None:
+            builder = OscBundleBuilder(IMMEDIATELY)
+            size = BUNDLE_HEADER_SIZE
+        builder.add_content(msg)
+        size += msgSize
+    if builder is not None:
+        yield builder.build()
 
-                # 3) debounce: no *new* names for quiet_ms
-                last_new = state["last_new_name_ts"]
-                if last_new and (time.monotonic() - last_new) * 1000.0 >= quiet_ms:
-                    print(state["seen"])
-                    return state["avatar_id"]
+def iter_leaves(node):
+    """Walks the OSCQuery tree without recursion, yields (rawName, name, leaf) where rawName is the path below node."""
+    contents = node.get("CONTENTS")
+    if contents is None:
+        return
+    stack = [(iter(contents.items()), "")]
+    while stack:
+        items, base = stack[-1]
+        for name, sub in items:
+            children = sub.get("CONTENTS")
+            if children is not None:
+                stack.append((iter(children.items()), f"{base}{name}/"))
+                break
+            yield (base + name, name, sub)
+        else:
+            stack.pop()
+
+@profiled("walk_parameters")
+def walk_parameters(node, prefix=PARAMETERS_PREFIX, with_meta=False) -> list[AvatarParameter]:
+    """Builds AvatarParameter objects straight from the /avatar/parameters node in one pass.
+    TYPE/RANGE/TAGS/DEFAULT are only kept in meta when with_meta is set."""
+    params = []
+    append = params.append
+    for rawName, name, leaf in iter_leaves(node):
+        meta = None
+        if with_meta:
+            meta = {"type": leaf.get("TYPE"), "default": leaf.get("DEFAULT"), "range": leaf.get("RANGE"), "tags": leaf.get("TAGS")}
+        append(AvatarParameter(name, prefix + rawName, leaf.get("VALUE"), rawName, meta))
+    return params
 
-                time.sleep(0.02)
-        finally:
-            server.shutdown()
-    
 def walk_node(node, prefix=""):
-    """Recursively walk the OSCQuery tree and yield parameter info."""
-    if "CONTENTS" in node:
-        for name, sub in node["CONTENTS"].items():
-            # ensure separator
-            new_prefix = f"{prefix}/{name}" if prefix else name
-            yield from walk_node(sub, new_prefix)
-    else:
-        # Leaf node
-        info = {
-            "path": prefix,
-            "type": node.get("TYPE"),
-            "default": node.get("DEFAULT"),
-            "range": node.get("RANGE"),
-            "tags": node.get("TAGS"),
-            "value": node.get("VALUE"),
+    """Walk the OSCQuery tree and yield parameter info."""
+    base = f"{prefix}/" if prefix else ""
+    for rawName, name, leaf in iter_leaves(node):
+        yield {
+            "path": base + rawName,
+            "type": leaf.get("TYPE"),
+            "default": leaf.get("DEFAULT"),
+            "range": leaf.get("RANGE"),
+            "tags": leaf.get("TAGS"),
+            "value": leaf.get("VALUE"),
         }
-        yield info
\ No newline at end of file
@@ -0,0 +1,120 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from FitCheck.logger import log
+
+class WriteBehind():
+    def __init__(self, name: str = "fitcheck-writer", retryDelay: float = 1.0, maxRetryDelay: float = 30.0):
+        """
+        Runs disk writes on a background thread. Jobs are keyed, submitting a job for a key that is still waiting
+        replaces it, so only the last write of a key is done. A failed job is retried (with backoff) until it succeeds
+        or a newer job for the same key replaces it. The backoff is per key, jobs of other keys keep running meanwhile.
+        """
+        self.retryDelay = retryDelay
+        self.maxRetryDelay = maxRetryDelay
+        self.lastError: Exception | None = None
+        self._cond = threading.Condition()
+        self._jobs: OrderedDict = OrderedDict()
+        self._retries: dict = {} # key -> (monotonic time it can run again, failures so far), for failed jobs
+        self._busy = False
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+        pass
+
+    def submit(self, key, job):
+        """
+        Queues job (a callable without arguments) to be run for key.
+        """
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Writer is closed")
+            self._jobs[key] = job
+            self._jobs.move_to_end(key) # runs after everything submitted before it, like a plain queue
+            self._retries.pop(key, None) # a new job for the key is tried right away
+            self._cond.notify_all()
+
+    def discard(self, key):
+        with self._cond:
+            self._jobs.pop(key, None)
+            self._retries.pop(key, None)
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._jobs) + (1 if self._busy else 0)
+
+    def flush(self, timeout: float | None = 5.0) -> bool:
+        """
+        Waits until every queued job ran. Returns False if some are still waiting after timeout (e.g. the disk keeps failing).
+        Failed jobs are retried right away once.
+        """
+        with self._cond:
+            self._retries = {key: (0.0, failures) for key, (_, failures) in self._retries.items()}
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: not self._jobs and not self._busy, timeout)
+
+    def close(self, timeout: float | None = 5.0) -> bool:
+        flushed = self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        return flushed
+
+    def _next_job(self):
+        # call with the lock held: the first job whose backoff is over, or the time the next one will be
+        now = time.monotonic()
+        wake = None
+        for key in self._jobs:
+            readyAt, _ = self._retries.get(key, (0.0, 0))
+            if readyAt <= now:
+                return key, None
+            wake = readyAt if wake is None else min(wake, readyAt)
+        return None, wake
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        return
+                    key, wake = self._next_job()
+                    if key is not None:
+                        break
+                    self._cond.wait(None if wake is None else wake - time.monotonic())
+                job = self._jobs.pop(key)
+                _, failures = self._retries.pop(key, (0.0, 0))
+                self._busy = True
+            try:
+                job()
+                self.lastError = None
+            except Exception as exc:
+                failures += 1
+                self.lastError = exc
+                log.warning("writer", "write for %s failed (%d), retrying: %s", key, failures, exc)
+                with self._cond:
+                    if key not in self._jobs: # nothing newer for that key, try it again after the others
+                        self._jobs[key] = job
+                        delay = min(self.retryDelay * 2 ** (failures - 1), self.maxRetryDelay)
+                        self._retries[key] = (time.monotonic() + delay, failures)
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+
+def atomic_write_text(path: Path, text: str):
+    """
+    Writes text to a temporary file next to path, syncs it, then swaps it in with os.replace.
+    A crash leaves either the old file or the new one, never half of it.
+    """
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp, "w", encoding="utf-8") as file:
+            file.write(text)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
@@ -1,39 +1,103 @@
 import sys
-import time
+import queue
 import threading
 from FitCheck.oscq_discovery import OscQueryDiscovery
-from FitCheck.avatarManager import AvatarManager
-from FitCheck.vrcClient import VRCClient
+from FitCheck.asyncAvatarManager import AsyncAvatarManager
+from FitCheck.asyncVrcClient import AsyncVRCClient
 from FitCheck.fletui import FletPresetManagerUI
+from FitCheck.logger import log
+from FitCheck.metrics import metrics
 import flet as ft
 
+PROBE_INTERVAL = 0.25 # seconds between two health checks while online
+PROBE_FAILURES = 2 # failed checks in a row before VRChat is shown offline
+OFFLINE_PROBE_INTERVAL = 1.0 # seconds between two checks of the last known endpoint while offline
+
 def main(page: ft.Page):
-    avatarManager = AvatarManager(client=None)
+    avatarManager = AsyncAvatarManager(client=None)
     ui = FletPresetManagerUI(avatarManager)
     stop_evt = threading.Event()
+    events = queue.Queue()
     def discovery_worker():
-        oscq = OscQueryDiscovery()
-        last_state = None
+        """
+        Keeps the online status from probing the known OSCQuery endpoint every PROBE_INTERVAL seconds.
+        mDNS events only matter when they bring a new endpoint, or when the probe confirms VRChat is gone.
+        """
+        oscq = OscQueryDiscovery(
+            on_online=lambda ip, port: events.put((True, ip, port)),
+            on_offline=lambda: events.put((False, "", 0)),
+        )
+        client = None # stays around while offline, its endpoint is probed until mDNS says VRChat moved
+        online = None
+        failures = 0
+        def go_online(ip, port, reuse=False):
+            nonlocal client, online, failures
+            if not reuse:
+                if client:
+                    client.close()
+                client = AsyncVRCClient(port, page.loop) # its listener runs on the page loop, next to the UI operations
+            try:
+                client.start_listener()
+            except OSError as exc:
+                log.warning("osc", "could not listen on port %d, falling back to OSCQuery polling: %s", client.listenPort, exc)
+            avatarManager.vrcclient = client
+            if online is False:
+                metrics.inc("discovery.flaps")
+            metrics.inc("discovery.online")
+            online = True
+            failures = 0
+            ui.set_vrchat_online(True, ip, port)
+            page.update()
+            ui._notify("VRChat is running !", 2000, "success")
+        def go_offline():
+            nonlocal online
+            if client:
+                client.stop_listener()
+            avatarManager.vrcclient = None
+            if online:
+                metrics.inc("discovery.flaps")
+            metrics.inc("discovery.offline")
+            online = False
+            ui.set_vrchat_online(False)
+            page.update()
+            ui._notify("VRChat is offline !", 2000, "error")
         while not stop_evt.is_set():
-            found = oscq.wait(2)
-            if found and last_state is not True:
-                ip, port = oscq.ip, oscq.port
-                client = VRCClient(port)
-                avatarManager.vrcclient = client
-                ui.set_vrchat_online(True, ip, port)
-                last_state = True
-                page.update()
-                ui._notify("VRChat is running !", 2000, "success")
-            elif not found and last_state is not False:
-                avatarManager.vrcclient = None
-                ui.set_vrchat_online(False)
-                last_state = False
-                page.update()
-                ui._notify("VRChat is offline !", 2000, "error")
-            time.sleep(0.5)
-            oscq.stop()
-            oscq = OscQueryDiscovery()
-  
+            if online is None:
+                timeout = 2
+            else:
+                timeout = PROBE_INTERVAL if online else OFFLINE_PROBE_INTERVAL
+            try:
+                found, ip, port = events.get(timeout=timeout)
+            except queue.Empty:
+                if client is None:
+                    if online is None:
+                        go_offline() # nothing announced yet, show VRChat as offline
+                elif online:
+                    failures = 0 if client.is_alive(PROBE_INTERVAL) else failures + 1
+                    if failures:
+                        metrics.inc("discovery.probe_failures")
+                    if failures >= PROBE_FAILURES:
+                        log.info("discovery", "VRChat stopped answering on port %d", client.oscqport)
+                        go_offline()
+                elif client.probe():
+                    go_online(client.ip, client.oscqport, reuse=True)
+                continue
+            if found:
+                if client and client.oscqport == port:
+                    if not online:
+                        go_online(ip, port, reuse=True)
+                    continue # same endpoint, nothing to reconnect
+                go_online(ip, port)
+            elif online is not False:
+                if online and client.probe():
+                    log.info("discovery", "mDNS lost VRChat but it still answers, staying online")
+                    metrics.inc("discovery.mdns_lost_ignored")
+                    continue
+                go_offline()
+        oscq.stop()
+        if client:
+            client.close()
+
     page.add(ft.Text("somehow we here"))
     ui.run(page)
     t = threading.Thread(target=discovery_worker, daemon=True)